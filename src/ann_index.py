@@ -0,0 +1,215 @@
+"""
+Construction and tuning of the FAISS index behind the vector store.
+
+FAISS_INDEX_TYPE selects the index:
+
+- ``flat``: exact search (IndexFlatL2), the default
+- ``ivf_flat``: inverted lists over FAISS_NLIST centroids, FAISS_NPROBE probed per query
+- ``ivf_pq``: as ivf_flat with product-quantized vectors (FAISS_PQ_M sub-vectors of FAISS_PQ_NBITS bits)
+- ``hnsw``: HNSW graph with FAISS_HNSW_M links, FAISS_HNSW_EF_SEARCH candidates per query
+
+IVF indexes are trained at build time; until the corpus has at least
+FAISS_MIN_TRAIN_VECTORS chunks a flat index is built instead. The type and
+parameters actually built are written to ``index_meta.json`` next to the index.
+
+Vectors are stored under the integer ids of their chunks in the docstore
+(see docstore.py), so flat and HNSW indexes are wrapped in IndexIDMap2.
+"""
+import json
+import os
+
+import faiss
+import numpy as np
+
+FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')
+FAISS_NLIST = int(os.getenv('FAISS_NLIST', '256'))
+FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', '16'))
+FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', '16'))
+FAISS_PQ_NBITS = int(os.getenv('FAISS_PQ_NBITS', '8'))
+FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', '32'))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv('FAISS_HNSW_EF_CONSTRUCTION', '200'))
+FAISS_HNSW_EF_SEARCH = int(os.getenv('FAISS_HNSW_EF_SEARCH', '64'))
+FAISS_MIN_TRAIN_VECTORS = int(os.getenv('FAISS_MIN_TRAIN_VECTORS', '1000'))
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+INDEX_META_FILE = "index_meta.json"
+
+# FAISS wants roughly this many training points per centroid
+_POINTS_PER_CENTROID = 39
+
+
+def default_index_params():
+    return {
+        "nlist": FAISS_NLIST,
+        "nprobe": FAISS_NPROBE,
+        "pq_m": FAISS_PQ_M,
+        "pq_nbits": FAISS_PQ_NBITS,
+        "hnsw_m": FAISS_HNSW_M,
+        "ef_construction": FAISS_HNSW_EF_CONSTRUCTION,
+        "ef_search": FAISS_HNSW_EF_SEARCH,
+    }
+
+
+def _can_train(index_type, params, n_vectors):
+    if index_type == "ivf_flat":
+        return n_vectors >= max(FAISS_MIN_TRAIN_VECTORS, 1)
+    if index_type == "ivf_pq":
+        return n_vectors >= max(FAISS_MIN_TRAIN_VECTORS, 2 ** params["pq_nbits"])
+    return True
+
+
+def _pq_subvectors(dim, pq_m):
+    # The number of sub-quantizers must divide the dimension
+    for m in range(min(pq_m, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def create_index(vectors, dim, index_type=None, params=None):
+    """Create an empty, trained index suitable for the given vectors.
+
+    Args:
+        vectors: float32 array (n, dim) used for training IVF indexes
+        dim: vector dimension
+        index_type: one of INDEX_TYPES, defaults to FAISS_INDEX_TYPE
+        params: overrides for default_index_params()
+
+    Returns:
+        (index, meta) where meta describes what was actually built
+    """
+    index_type = index_type or FAISS_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE: {index_type}")
+    params = {**default_index_params(), **(params or {})}
+    n_vectors = len(vectors)
+
+    built_type = index_type if _can_train(index_type, params, n_vectors) else "flat"
+    built_params = {}
+    if built_type == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    elif built_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+        hnsw.hnsw.efConstruction = params["ef_construction"]
+        index = faiss.IndexIDMap2(hnsw)
+        built_params = {"hnsw_m": params["hnsw_m"], "ef_construction": params["ef_construction"]}
+    else:
+        nlist = max(1, min(params["nlist"], n_vectors // _POINTS_PER_CENTROID))
+        quantizer = faiss.IndexFlatL2(dim)
+        if built_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+            built_params = {"nlist": nlist}
+        else:
+            pq_m = _pq_subvectors(dim, params["pq_m"])
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, params["pq_nbits"])
+            built_params = {"nlist": nlist, "pq_m": pq_m, "pq_nbits": params["pq_nbits"]}
+        index.train(np.ascontiguousarray(vectors, dtype="float32"))
+
+    meta = {
+        "index_type": built_type,
+        "requested_type": index_type,
+        "params": built_params,
+        "dimension": dim,
+        "trained_on": n_vectors,
+    }
+    configure_search(index, meta, params)
+    return index, meta
+
+
+def configure_search(index, meta, params=None):
+    """Apply query-time parameters (nprobe, efSearch); these need no rebuild"""
+    params = {**default_index_params(), **(params or {})}
+    index_type = meta.get("index_type", "flat")
+    if index_type in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    elif index_type == "hnsw":
+        _base_index(index).hnsw.efSearch = params["ef_search"]
+
+
+def search_parameters(index, meta, selector, exhaustive=False):
+    """SearchParameters restricting a search to the ids accepted by selector.
+
+    The configured nprobe/efSearch are carried over, since parameters passed
+    to search() replace the index's own. exhaustive=True probes every IVF list,
+    making a search over a small id set exact.
+    """
+    index_type = meta.get("index_type", "flat")
+    if index_type in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.extract_index_ivf(index)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nlist if exhaustive else ivf.nprobe)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=_base_index(index).hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _base_index(index):
+    """The index wrapped by an IndexIDMap2, or the index itself"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def needs_rebuild(meta, n_vectors, index_type=None, params=None):
+    """True when the configured index differs from the built one and can now be built"""
+    index_type = index_type or FAISS_INDEX_TYPE
+    params = {**default_index_params(), **(params or {})}
+    if not _can_train(index_type, params, n_vectors):
+        return False
+    if meta.get("index_type", "flat") != index_type:
+        return True
+    built = meta.get("params", {})
+    if index_type == "hnsw":
+        return built.get("hnsw_m") != params["hnsw_m"]
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # Retrain once the corpus has grown enough to support more centroids
+        wanted_nlist = max(1, min(params["nlist"], n_vectors // _POINTS_PER_CENTROID))
+        if built.get("nlist", 0) < wanted_nlist // 2:
+            return True
+        if index_type == "ivf_pq":
+            return built.get("pq_nbits") != params["pq_nbits"]
+    return False
+
+
+def supports_remove(meta):
+    # HNSW graphs cannot drop nodes, so those indexes are rebuilt instead
+    return meta.get("index_type", "flat") != "hnsw"
+
+
+def index_ids(index):
+    """Ids of all vectors stored in an index built by create_index"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    ivf = faiss.extract_index_ivf(index)
+    invlists = ivf.invlists
+    ids = []
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+    return np.concatenate(ids).astype("int64") if ids else np.zeros(0, dtype="int64")
+
+
+def reconstruct_vectors(index, meta, ids):
+    """Read stored vectors back from the index by id, or None if the index is lossy"""
+    index_type = meta.get("index_type", "flat")
+    if index_type == "ivf_pq":
+        return None
+    if index_type == "ivf_flat":
+        faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Hashtable)
+    if not len(ids):
+        return np.zeros((0, index.d), dtype="float32")
+    return np.vstack([index.reconstruct(int(i)) for i in ids])
+
+
+def write_index_meta(path, meta):
+    with open(os.path.join(path, INDEX_META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_index_meta(path):
+    try:
+        with open(os.path.join(path, INDEX_META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Indexes saved before index types were configurable are flat
+        return {"index_type": "flat", "params": {}}
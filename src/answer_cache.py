@@ -0,0 +1,129 @@
+"""
+Semantic cache of chat answers.
+
+Questions are embedded anyway for retrieval; the same vector is looked up in
+a small in-memory FAISS inner-product index of earlier questions. If the
+closest one has cosine similarity of at least ANSWER_CACHE_THRESHOLD, its
+stored answer is returned without calling the LLM.
+
+Every entry is tagged with the versions of the index shards it was answered
+from, as a tuple of (shard, version) pairs, and with the metadata filter of
+the question (its scope). An entry is only returned to a query with the same
+scope that searched exactly the same shard versions, so answers never
+outlive the documents they were based on; entries of the same shards at an
+older version are dropped when they are found. Entries are also evicted
+least-recently-used beyond ANSWER_CACHE_MAX_ENTRIES and expire after
+ANSWER_CACHE_TTL_SECONDS.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import faiss
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000'))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+# Neighbours examined per lookup, since the closest ones may belong to other shards
+ANSWER_CACHE_CANDIDATES = int(os.getenv('ANSWER_CACHE_CANDIDATES', '8'))
+
+CachedAnswer = namedtuple("CachedAnswer", ["question", "answer", "sources", "version", "scope", "created_at"])
+
+
+def _shards(version):
+    return tuple(shard for shard, _ in version)
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype="float32").reshape(1, -1)
+    faiss.normalize_L2(vector)
+    return vector
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds=ANSWER_CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()  # faiss id -> CachedAnswer, oldest first
+        self._next_id = 0
+
+    def _remove(self, entry_id):
+        self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.array([entry_id], dtype="int64"))
+
+    def lookup(self, query_vector, version, scope=None):
+        """Return the CachedAnswer of a similar earlier question over the same shard versions, or None"""
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            scores, ids = self._index.search(_normalize(query_vector), min(ANSWER_CACHE_CANDIDATES, len(self._entries)))
+            for score, entry_id in zip(scores[0], ids[0]):
+                entry = self._entries.get(int(entry_id))
+                if score < self.threshold:
+                    break
+                if entry is None or entry.scope != scope:
+                    continue
+                if entry.version != version:
+                    if _shards(entry.version) == _shards(version):
+                        # Answered from an older version of the same shards
+                        self._remove(int(entry_id))
+                        self.invalidations += 1
+                    continue
+                if self.ttl_seconds and time.time() - entry.created_at > self.ttl_seconds:
+                    self._remove(int(entry_id))
+                    continue
+
+                self._entries.move_to_end(int(entry_id))
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, question, answer, sources, version, scope=None):
+        with self._lock:
+            vector = _normalize(query_vector)
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = CachedAnswer(question, answer, sources, version, scope, time.time())
+
+            while len(self._entries) > self.max_entries:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+                self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+_cache = SemanticAnswerCache() if ANSWER_CACHE_ENABLED else None
+
+
+def get_answer_cache():
+    """Return the process-wide answer cache, or None when ANSWER_CACHE_ENABLED is false"""
+    return _cache
@@ -1,47 +1,177 @@
-from fastapi import UploadFile, File, HTTPException, Depends, status
+from fastapi import UploadFile, File, Form, HTTPException, Depends, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi import Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
-from bson import ObjectId
-from gridfs import GridFS
+import asyncio
 import os
-import io
-from PyPDF2 import PdfReader
+import json
+import time
+
+from bson import ObjectId
 
 # Import models
 from models.api import (
     TokenResponse, 
     UserResponse, 
     RegisterRequest,  
+    RetrievalOptions,
     ChatRequest, 
     ChatResponse, 
+    ChatBatchRequest,
+    ChatBatchItem,
+    ChatBatchResponse,
+    IngestJobResponse,
 )
-from models.auth import User, LoginRequest
+from models.auth import User, LoginRequest, UserUpdate
 
 # Import config and auth
 from config import app, db, ACCESS_TOKEN_EXPIRE_MINUTES
 from auth import (
     get_current_active_user, 
     get_admin_user,
-    get_password_hash, 
+    get_password_hash_async,
     create_access_token, 
-    authenticate_user
+    authenticate_user,
+    invalidate_user,
+    shutdown_password_executor,
 )
 
 # Import app functions
-from app import get_text_chunks, get_vector_store, get_conversational_chain, GoogleGenerativeAIEmbeddings, FAISS
+from app import (
+    get_chat_model,
+    format_qa_prompt,
+    load_vector_store,
+    migrate_legacy_index,
+    assign_chunk_shards,
+    delete_from_vector_store,
+    retrieve,
+    retrieve_batch,
+    remember_answer,
+    answer_question,
+    document_sources,
+    get_embeddings,
+    rebuild_vector_store,
+    CHAT_BATCH_CONCURRENCY,
+    CHAT_BATCH_MAX_QUESTIONS,
+)
+from ann_index import INDEX_TYPES
+from answer_cache import get_answer_cache
+from jobs import enqueue_ingest_job, cancel_ingest_jobs, active_ingest_job, get_ingest_job, start_ingest_workers, stop_ingest_workers
+from storage import save_upload, delete_file
+from shards import SHARED_SHARD, list_shards, readable_shards, shard_query, user_shard
+from database import run_db, find_all, shutdown_db_executor
+from conversation_log import log_conversation, start_conversation_writer, stop_conversation_writer
+from conversations import conversation_json, conversation_page, iter_conversations, migrate_conversation_timestamps
+from extraction import shutdown_extraction_pool
+from metrics import (
+    PROFILING_ENABLED,
+    PROMPT_TOKENS,
+    REQUEST_SECONDS,
+    SamplingProfiler,
+    profile_path,
+    render as render_metrics,
+    server_timing,
+    stage,
+    stage_totals,
+    start_request_timings,
+)
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """
+    Record request durations, report the pipeline stages of the request in a
+    Server-Timing header and, with PROFILING_ENABLED and "X-Profile: 1", sample
+    the request with the profiler until its response body is sent.
+    """
+    timings = start_request_timings()
+    profiler = None
+    if PROFILING_ENABLED and request.headers.get("x-profile") == "1":
+        profiler = SamplingProfiler().__enter__()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        if profiler is not None:
+            # Otherwise the sampling thread would keep running for the life of the process
+            profiler.__exit__(None, None, None)
+        raise
+    elapsed = time.perf_counter() - started
+    
+    route = request.scope.get("route")
+    # Route templates rather than raw paths keep the number of series bounded
+    REQUEST_SECONDS.observe(
+        elapsed, method=request.method, route=route.path if route is not None else "unmatched",
+        status=response.status_code
+    )
+    response.headers["Server-Timing"] = ", ".join(filter(None, [
+        server_timing(timings), f"total;dur={elapsed * 1000:.1f}"
+    ]))
+    
+    if profiler is not None:
+        path = profile_path(request.url.path)
+        response.headers["X-Profile-File"] = path
+        body = response.body_iterator
+        
+        async def profiled_body():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                profiler.__exit__(None, None, None)
+                profiler.write(path)
+                print(f"Đã lưu profile: {path}")
+        response.body_iterator = profiled_body()
+    return response
+
+@app.on_event("startup")
+async def load_vector_index():
+    """Load the FAISS index once so requests share it instead of reading it from disk"""
+    try:
+        if await run_in_threadpool(migrate_legacy_index, os.getenv('MODEL_NAME', 'Google AI'), os.getenv('API_KEY')):
+            print("Đã chuyển vector index sang docstore SQLite")
+        await run_in_threadpool(assign_chunk_shards, os.getenv('MODEL_NAME', 'Google AI'), os.getenv('API_KEY'))
+        await run_in_threadpool(load_vector_store, os.getenv('MODEL_NAME', 'Google AI'), os.getenv('API_KEY'))
+    except FileNotFoundError:
+        print("Chưa có vector index, index sẽ được tạo khi upload PDF đầu tiên")
+    except Exception as e:
+        print(f"Lỗi khi tải vector index: {str(e)}")
+
+@app.on_event("startup")
+async def migrate_conversations():
+    try:
+        converted = await run_db(migrate_conversation_timestamps)
+        if converted:
+            print(f"Đã chuyển timestamp của {converted} conversation sang datetime")
+    except Exception as e:
+        print(f"Lỗi khi chuyển timestamp của conversation: {str(e)}")
+
+@app.on_event("startup")
+async def start_background_ingestion():
+    start_ingest_workers()
+    start_conversation_writer()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await stop_ingest_workers()
+    await stop_conversation_writer()
+    shutdown_extraction_pool()
+    shutdown_password_executor()
+    shutdown_db_executor()
 
 # Authentication endpoints
 @app.post("/register/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(user_data: RegisterRequest):
     # Check if username already exists
-    if db.users.find_one({"$or": [{"username": user_data.username}, {"email": user_data.email}]}):
+    if await run_db(db.users.find_one, {"$or": [{"username": user_data.username}, {"email": user_data.email}]}):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username or email already registered"
         )
     
-    # Hash the password
-    hashed_password = get_password_hash(user_data.password)
+    # Hash the password (on the bcrypt pool, off the event loop)
+    hashed_password = await get_password_hash_async(user_data.password)
     
     # Create user document
     user_dict = user_data.dict()
@@ -50,16 +180,16 @@ async def register_user(user_data: RegisterRequest):
     user_dict['created_at'] = datetime.utcnow()
     
     # Insert user into database
-    result = db.users.insert_one(user_dict)
+    result = await run_db(db.users.insert_one, user_dict)
     
     # Return created user
-    created_user = db.users.find_one({"_id": result.inserted_id})
+    created_user = await run_db(db.users.find_one, {"_id": result.inserted_id})
     created_user['id'] = str(created_user.pop('_id'))
     return created_user
 
 @app.post("/login/", response_model=TokenResponse)
 async def login_for_access_token(form_data: LoginRequest ):
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -86,33 +216,56 @@ async def login_for_access_token(form_data: LoginRequest ):
     }
 
 # Protected endpoints
+@app.patch("/users/{username}", response_model=UserResponse)
+async def update_user(
+    username: str,
+    changes: UserUpdate,
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Change or disable a user account (admin only). Takes effect for the
+    user's existing tokens at once in this process, and within
+    AUTH_CACHE_TTL_SECONDS in other worker processes.
+    """
+    update = {key: value for key, value in changes.dict().items() if value is not None}
+    if not update:
+        raise HTTPException(status_code=400, detail="No changes given")
+    if "email" in update and await run_db(
+        db.users.find_one, {"email": update["email"], "username": {"$ne": username}}
+    ):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    result = await run_db(db.users.update_one, {"username": username}, {"$set": update})
+    invalidate_user(username)
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    updated_user = await run_db(db.users.find_one, {"username": username})
+    updated_user['id'] = str(updated_user.pop('_id'))
+    return updated_user
+
 @app.post("/upload-pdfs/")
 async def upload_pdfs(
     files: List[UploadFile] = File(...),
+    shared: bool = Form(False),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Upload PDF files to the server and store them in the database.
+    Upload PDF files to the server and queue them for indexing.
+    Files go into the uploader's own index shard, or into the shared shard
+    readable by everyone when an admin sets shared=true.
+    Returns immediately with one ingestion job id per file.
     Requires authentication.
     """
+    if shared and not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can upload shared files")
+    shard = SHARED_SHARD if shared else user_shard(current_user.username)
     try:
-        # Initialize GridFS
-        fs = GridFS(db)
-        
         uploaded_files = []
         
         for file in files:
-            # Read file contents
-            contents = await file.read()
-            
-            # Save file to GridFS
-            file_id = fs.put(
-                contents,
-                filename=file.filename,
-                content_type=file.content_type,
-                uploadDate=datetime.utcnow(),
-                user_id=current_user.username
-            )
+            # Stream the file into GridFS, reusing the blob if the content is already stored
+            file_id, size, sha256, duplicate = await save_upload(file, current_user.username)
             
             # Prepare file info for database
             file_info = {
@@ -120,20 +273,48 @@ async def upload_pdfs(
                 "upload_date": datetime.utcnow(),
                 "user_id": current_user.username,
                 "file_id": str(file_id),
+                "sha256": sha256,
+                "shard": shard,
                 "metadata": {
                     "content_type": file.content_type,
-                    "size": len(contents)
+                    "size": size
                 }
             }
             
-            # Save to database
-            result = db.files.insert_one(file_info)
+            # Identical content that is indexed or being indexed in the same shard needs no second job;
+            # after a failed or cancelled job it is queued again
+            same_content = await find_all(
+                db.files, {"file_id": str(file_id), **shard_query(shard)}, {"indexed": 1, "job_id": 1}
+            ) if duplicate else []
+            indexed = any(record.get("indexed") for record in same_content)
+            active_job = None if indexed else await run_db(
+                active_ingest_job, [record["job_id"] for record in same_content if record.get("job_id")]
+            )
+            
+            if indexed or active_job:
+                file_info["indexed"] = indexed
+                file_info["deduplicated"] = True
+                if active_job:
+                    # The job records its chunk ids on this record too
+                    file_info["job_id"] = active_job
+                result = await run_db(db.files.insert_one, file_info)
+            else:
+                file_info["indexed"] = False
+                result = await run_db(db.files.insert_one, file_info)
+                # Extraction, chunking and embedding run in the background workers
+                job_id = await run_db(
+                    enqueue_ingest_job, str(result.inserted_id), str(file_id), file.filename, current_user.username, shard
+                )
+                await run_db(db.files.update_one, {"_id": result.inserted_id}, {"$set": {"job_id": job_id}})
+                file_info["job_id"] = job_id
+            
+            file_info.pop("_id", None)
             file_info["id"] = str(result.inserted_id)
             
             uploaded_files.append(file_info)
         
         return {
-            "message": "Files uploaded successfully",
+            "message": "Files uploaded successfully, indexing in background",
             "uploaded_files": uploaded_files,
             "timestamp": datetime.utcnow().isoformat()
         }
@@ -144,6 +325,26 @@ async def upload_pdfs(
             detail=f"Error uploading files: {str(e)}"
         )
 
+@app.get("/ingest-jobs/{job_id}", response_model=IngestJobResponse)
+async def get_ingest_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Report the stage, progress and error of an ingestion job
+    """
+    job = await run_db(get_ingest_job, job_id)
+    if job is None or (job["user_id"] != current_user.username and not current_user.is_admin):
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+def _retrieval_filter(request: RetrievalOptions) -> Optional[Dict[str, Any]]:
+    """Metadata filter for the vector search built from the optional request fields"""
+    filter = dict(request.filters or {})
+    if request.file_ids is not None:
+        filter["file_id"] = request.file_ids
+    return filter or None
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_pdfs(request: ChatRequest):
     try:
@@ -157,50 +358,25 @@ async def chat_with_pdfs(request: ChatRequest):
                 detail="API key not configured"
             )
 
-        # Lấy tất cả file PDF từ MongoDB
-        files = list(db.files.find())
-        if not files:
+        # PDF đã được index lúc upload, chỉ cần embed câu hỏi và tìm kiếm
+        try:
+            result = await run_in_threadpool(
+                answer_question, request.question, model_name, api_key, readable_shards(None), _retrieval_filter(request)
+            )
+        except FileNotFoundError:
             raise HTTPException(status_code=400, detail="No PDF files uploaded")
-        
-        # Tạo GridFS để đọc file
-        fs = GridFS(db)
-        
-        # Đọc và xử lý PDF trực tiếp từ GridFS
-        text = ""
-        for file in files:
-            try:
-                # Đọc file từ GridFS
-                grid_file = fs.get(ObjectId(file["file_id"]))
-                # Đọc nội dung PDF trực tiếp từ bộ nhớ
-                with io.BytesIO(grid_file.read()) as pdf_file:
-                    # Đọc PDF trực tiếp từ BytesIO
-                    pdf_reader = PdfReader(pdf_file)
-                    for page in pdf_reader.pages:
-                        text += page.extract_text()
-            except Exception as e:
-                print(f"Lỗi khi đọc file: {str(e)}")
-                continue
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="Không thể đọc nội dung từ file PDF")
-        
-        text_chunks = get_text_chunks(text, model_name)
-        vector_store = get_vector_store(text_chunks, model_name, api_key)
-        
-        embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=api_key
-        )
-        
-        new_db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-        docs = new_db.similarity_search(request.question)
-        chain = get_conversational_chain(model_name, vectorstore=new_db, api_key=api_key)
-        response = chain({"input_documents": docs, "question": request.question}, return_only_outputs=True)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         return ChatResponse(
-            answer=response['output_text'],
+            answer=result.answer,
             timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            model_name=model_name
+            model_name=model_name,
+            cached=result.cached,
+            prompt_tokens=result.prompt_tokens
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -220,102 +396,354 @@ async def user_chat(
                 detail="API key not configured"
             )
         
-        # Initialize embeddings
-        embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=api_key
-        )
-
-        
-        # Load vector store from FAISS
         try:
-            vector_store = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-        except Exception as e:
+            result = await run_in_threadpool(
+                answer_question, request.question, model_name, api_key,
+                readable_shards(current_user), _retrieval_filter(request)
+            )
+        except FileNotFoundError as e:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Vector store not found. Please upload PDFs first. Error: {str(e)}"
             )
-        
-        # Create conversation chain
-        chain = get_conversational_chain(vector_store, api_key)
-        
-        # Process the question
-        response = chain({"question": request.question, "chat_history": []})
-        
-        new_db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-        docs = new_db.similarity_search(request.question)
-        chain = get_conversational_chain(model_name, vectorstore=new_db, api_key=api_key)
-        response = chain({"input_documents": docs, "question": request.question}, return_only_outputs=True)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         # Lưu lịch sử cuộc trò chuyện vào MongoDB
         conversation = {
-            "user_id": user_id,
+            "user_id": current_user.username,
             "question": request.question,
-            "answer": response['output_text'],
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "answer": result.answer,
+            "timestamp": datetime.utcnow(),
             "model_name": model_name
         }
-        db.conversations.insert_one(conversation)
+        await log_conversation(conversation)
         
         return ChatResponse(
-            answer=response['output_text'],
+            answer=result.answer,
             timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            model_name=model_name
+            model_name=model_name,
+            cached=result.cached,
+            prompt_tokens=result.prompt_tokens
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-@app.get("/conversations/me/", response_model=List[Dict[str, Any]])
-async def get_user_conversations(
-    limit: int = 10,
-    page: int = 1,
+async def _stream_answer(question: str, model_name: str, api_key: str, shards: List[str],
+                         filter: Optional[Dict[str, Any]] = None, on_complete=None):
+    """
+    Yield SSE events: one "token" event per chunk produced by the model, then a
+    "done" event with the full answer, sources and timings (or an "error" event).
+    on_complete(answer, timestamp) is awaited after a successful answer.
+    """
+    started = time.perf_counter()
+    # The 200 response has already started: every failure must end the stream with an error event
+    try:
+        retrieval = await run_in_threadpool(retrieve, question, model_name, api_key, shards, filter)
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        
+        if retrieval.cached is not None:
+            # A semantically equivalent question was answered before
+            answer = retrieval.cached.answer
+            sources = retrieval.cached.sources
+            first_token_ms = retrieval_ms
+            yield _sse_event("token", {"text": answer})
+        else:
+            model = get_chat_model(model_name, api_key)
+            prompt = format_qa_prompt(retrieval.docs, question)
+            
+            parts = []
+            first_token_ms = None
+            PROMPT_TOKENS.inc(retrieval.prompt_tokens)
+            with stage("llm"):
+                async for chunk in model.astream(prompt):
+                    if not chunk.content:
+                        continue
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                    parts.append(chunk.content)
+                    yield _sse_event("token", {"text": chunk.content})
+            
+            answer = "".join(parts)
+            sources = document_sources(retrieval.docs)
+            remember_answer(retrieval, answer)
+        
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if on_complete is not None:
+            await on_complete(answer, timestamp)
+        
+        yield _sse_event("done", {
+            "answer": answer,
+            "timestamp": timestamp,
+            "model_name": model_name,
+            "cached": retrieval.cached is not None,
+            "prompt_tokens": retrieval.prompt_tokens,
+            "sources": sources,
+            "timings": {
+                "retrieval_ms": round(retrieval_ms, 1),
+                "first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+                # Streamed stages finish after the Server-Timing header has been sent
+                "stages": stage_totals(),
+            },
+        })
+    except FileNotFoundError:
+        yield _sse_event("error", {"detail": "No PDF files uploaded"})
+    except Exception as e:
+        yield _sse_event("error", {"detail": str(e)})
+
+def _sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/stream")
+async def chat_with_pdfs_stream(request: ChatRequest):
+    """
+    Same as /chat, but streams the answer as Server-Sent Events while the model generates it
+    """
+    api_key = os.getenv('API_KEY')
+    model_name = os.getenv('MODEL_NAME', 'Google AI')
+    
+    if not api_key:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="API key not configured"
+        )
+    
+    return _sse_response(_stream_answer(
+        request.question, model_name, api_key, readable_shards(None), _retrieval_filter(request)
+    ))
+
+@app.post("/user/chat/stream")
+async def user_chat_stream(
+    request: ChatRequest,
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Get chat history for the current authenticated user
+    Same as /user/chat, but streams the answer as Server-Sent Events.
+    The conversation is saved once the answer is complete.
     """
-    skip = (page - 1) * limit
-    conversations = list(
-        db.conversations
-        .find({"user_id": current_user.username})
-        .sort("timestamp", -1)
-        .skip(skip)
-        .limit(limit)
+    api_key = os.getenv('API_KEY')
+    model_name = os.getenv('MODEL_NAME', 'Google AI')
+    
+    if not api_key:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="API key not configured"
+        )
+    
+    async def save_conversation(answer, timestamp):
+        await log_conversation({
+            "user_id": current_user.username,
+            "question": request.question,
+            "answer": answer,
+            "timestamp": datetime.utcnow(),
+            "model_name": model_name
+        })
+    
+    return _sse_response(_stream_answer(
+        request.question, model_name, api_key, readable_shards(current_user), _retrieval_filter(request),
+        on_complete=save_conversation
+    ))
+
+async def _answer_batch(retrievals, model_name: str, api_key: str):
+    """
+    Answer retrieved questions with at most CHAT_BATCH_CONCURRENCY model calls at a time.
+    Yields a ChatBatchItem per question as soon as it is answered; a failed
+    question yields an item with its error instead of stopping the batch.
+    """
+    model = get_chat_model(model_name, api_key)
+    semaphore = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+    
+    async def answer(index, retrieval):
+        if retrieval.cached is not None:
+            return ChatBatchItem(
+                index=index, question=retrieval.question, answer=retrieval.cached.answer,
+                cached=True, sources=retrieval.cached.sources
+            )
+        try:
+            async with semaphore:
+                PROMPT_TOKENS.inc(retrieval.prompt_tokens)
+                with stage("llm"):
+                    response = await model.ainvoke(format_qa_prompt(retrieval.docs, retrieval.question))
+            remember_answer(retrieval, response.content)
+            return ChatBatchItem(
+                index=index, question=retrieval.question, answer=response.content,
+                prompt_tokens=retrieval.prompt_tokens, sources=document_sources(retrieval.docs)
+            )
+        except Exception as e:
+            return ChatBatchItem(index=index, question=retrieval.question, error=str(e))
+    
+    tasks = [asyncio.create_task(answer(i, retrieval)) for i, retrieval in enumerate(retrievals)]
+    try:
+        for next_item in asyncio.as_completed(tasks):
+            yield await next_item
+    finally:
+        # The client went away before the batch finished
+        for task in tasks:
+            task.cancel()
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch(request: ChatBatchRequest):
+    """
+    Answer many questions like /chat. All questions are embedded in one call and
+    searched with one FAISS search per shard; answers are generated concurrently.
+    With "stream": true the results are streamed as NDJSON, one line per question
+    in the order they finish; otherwise they are returned in question order.
+    """
+    api_key = os.getenv('API_KEY')
+    model_name = os.getenv('MODEL_NAME', 'Google AI')
+    
+    if not api_key:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="API key not configured"
+        )
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(request.questions) > CHAT_BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {CHAT_BATCH_MAX_QUESTIONS} questions per batch"
+        )
+    
+    try:
+        retrievals = await run_in_threadpool(
+            retrieve_batch, request.questions, model_name, api_key, readable_shards(None), _retrieval_filter(request)
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail="No PDF files uploaded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if request.stream:
+        async def lines():
+            async for item in _answer_batch(retrievals, model_name, api_key):
+                yield item.json() + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+    
+    results = [item async for item in _answer_batch(retrievals, model_name, api_key)]
+    return ChatBatchResponse(
+        results=sorted(results, key=lambda item: item.index),
+        timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        model_name=model_name
     )
+
+@app.get("/cache/stats")
+async def get_cache_stats(current_user: User = Depends(get_admin_user)):
+    """
+    Hit/miss counters of the semantic answer cache and the embedding cache (admin only)
+    """
+    answer_cache = get_answer_cache()
+    embeddings = get_embeddings(os.getenv('MODEL_NAME', 'Google AI'), os.getenv('API_KEY'))
+    return {
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "embedding_cache": embeddings.stats() if hasattr(embeddings, "stats") else None,
+    }
+
+@app.post("/index/rebuild")
+async def rebuild_index(
+    index_type: Optional[str] = None,
+    shard: Optional[str] = None,
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Rebuild one shard, or every shard, with the given or configured FAISS index type (admin only)
+    """
+    if index_type is not None and index_type not in INDEX_TYPES:
+        raise HTTPException(status_code=400, detail=f"index_type must be one of {', '.join(INDEX_TYPES)}")
+    if shard is not None and shard not in list_shards():
+        raise HTTPException(status_code=404, detail="Shard not found")
     
+    rebuilt = {}
+    for name in [shard] if shard is not None else list_shards():
+        try:
+            rebuilt[name] = await run_in_threadpool(
+                rebuild_vector_store, os.getenv('MODEL_NAME', 'Google AI'), os.getenv('API_KEY'), index_type, name
+            )
+        except FileNotFoundError:
+            continue
+    if not rebuilt:
+        raise HTTPException(status_code=404, detail="No vector index to rebuild")
+    return {"message": "Vector index rebuilt", "index": rebuilt}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Stage latency histograms and counters in the Prometheus text format
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+def _conversation_list(conversations, next_cursor, response: Response):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     # Convert ObjectId to string for JSON serialization
     for conv in conversations:
         conv["_id"] = str(conv["_id"])
-    
     return conversations
 
+@app.get("/conversations/me/", response_model=List[Dict[str, Any]])
+async def get_user_conversations(
+    response: Response,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get chat history for the current authenticated user, newest first.
+    Pass the X-Next-Cursor response header as cursor to get the next page.
+    """
+    try:
+        conversations, next_cursor = await conversation_page(current_user.username, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _conversation_list(conversations, next_cursor, response)
+
 @app.get("/conversations/all/", response_model=List[Dict[str, Any]])
 async def get_all_conversations(
+    response: Response,
     limit: int = 10,
-    page: int = 1,
+    cursor: Optional[str] = None,
+    user_id: Optional[str] = None,
     current_user: User = Depends(get_admin_user)
 ):
     """
-    Get all chat history (admin only)
+    Get all chat history (admin only), newest first; paged like /conversations/me/
     """
-    skip = (page - 1) * limit
-    conversations = list(
-        db.conversations
-        .find()
-        .sort("timestamp", -1)
-        .skip(skip)
-        .limit(limit)
+    try:
+        conversations, next_cursor = await conversation_page(user_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _conversation_list(conversations, next_cursor, response)
+
+@app.get("/conversations/export")
+async def export_conversations(
+    user_id: Optional[str] = None,
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Stream all chat history (admin only) as NDJSON, one conversation per line
+    """
+    async def lines():
+        async for conversation in iter_conversations(user_id):
+            yield conversation_json(conversation) + "\n"
+    return StreamingResponse(
+        lines(), media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'}
     )
-    
-    # Convert ObjectId to string for JSON serialization
-    for conv in conversations:
-        conv["_id"] = str(conv["_id"])
-    
-    return conversations
 
 @app.get("/pdf-files")
 async def list_pdf_files(user_id: Optional[str] = None):
@@ -324,7 +752,7 @@ async def list_pdf_files(user_id: Optional[str] = None):
         if user_id:
             query["user_id"] = user_id
         
-        files = list(db.files.find(query))
+        files = await find_all(db.files, query, {"vector_ids": 0})
         for file in files:
             file["_id"] = str(file["_id"])
             file["file_id"] = str(file["file_id"])
@@ -333,23 +761,61 @@ async def list_pdf_files(user_id: Optional[str] = None):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/pdf-files/{file_id}")
-async def delete_pdf_file(file_id: str):
+@app.delete("/pdf-files/{record_id}")
+async def delete_pdf_file(record_id: str):
+    """
+    Delete one uploaded file by the id returned by the upload (its db.files record).
+    file_id is not enough: identical uploads of several users share one GridFS blob.
+    """
     try:
-        # Khởi tạo GridFS
-        fs = GridFS(db)
-        
-        # Xóa file từ GridFS
         try:
-            fs.delete(ObjectId(file_id))
-        except:
-            pass
-            
+            object_id = ObjectId(record_id)
+        except Exception:
+            raise HTTPException(status_code=404, detail="PDF file not found")
+        
         # Xóa thông tin file từ MongoDB
-        result = db.files.delete_one({"file_id": file_id})
-        if result.deleted_count == 0:
+        # The deleted document holds the vector ids of an ingestion job that finished before it
+        record = await run_db(db.files.find_one_and_delete, {"_id": object_id})
+        if record is None:
             raise HTTPException(status_code=404, detail="PDF file not found")
+        file_id = record["file_id"]
+        shard = record.get("shard") or SHARED_SHARD
+        
+        # Các bản ghi trùng nội dung dùng chung một blob GridFS, và một bộ vector trong mỗi shard
+        
+        remaining = await find_all(db.files, {"file_id": file_id}, {"vector_ids": 1, "shard": 1, "job_id": 1})
+        same_shard = [r for r in remaining if (r.get("shard") or SHARED_SHARD) == shard]
+        if record.get("job_id") and not any(r.get("job_id") == record["job_id"] for r in same_shard):
+            # No other record waits for this job; a running job removes the chunks it already added
+            await run_db(cancel_ingest_jobs, record["job_id"])
+        
+        if not same_shard:
+            # Không còn bản ghi nào trong shard dùng các vector này: xóa các chunk khỏi shard
+            await run_in_threadpool(
+                delete_from_vector_store,
+                record.get("vector_ids", []),
+                os.getenv('MODEL_NAME', 'Google AI'),
+                os.getenv('API_KEY'),
+                shard
+            )
+        elif record.get("vector_ids"):
+            # Chuyển danh sách vector sang bản ghi còn lại của shard
+            # Merged rather than replaced: that record may hold ids of its own indexing
+            await run_db(
+                db.files.update_one,
+                {"_id": same_shard[0]["_id"]},
+                {"$addToSet": {"vector_ids": {"$each": record["vector_ids"]}}}
+            )
+        
+        if not remaining:
+            # Xóa file từ GridFS khi không còn bản ghi nào dùng blob này
+            try:
+                await run_db(delete_file, file_id)
+            except Exception:
+                pass
         
         return {"message": "PDF file deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,93 +1,229 @@
-from PyPDF2 import PdfReader
-from pdf2image import convert_from_bytes
-import pytesseract
-from io import BytesIO
-
 # Update imports for LangChain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
+from langchain_google_genai import ChatGoogleGenerativeAI
 
 from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
 
 from datetime import datetime
+from collections import namedtuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import os
+import json
+import uuid
+
+from vector_store import INDEX_PATH, VectorStoreHolder
+from shards import SHARED_SHARD, list_shards, shard_path
+from ann_index import FAISS_INDEX_TYPE, needs_rebuild, supports_remove
+from docstore import DiskVectorStore, get_chunk_store
+from embedding_cache import CachedEmbeddings, get_embedding_store
+from embeddings import EMBEDDING_BACKEND, create_embeddings, embed_queries
+from extraction import extract_pages, extract_texts
+from chunking import count_tokens, get_text_splitter
+from context_packer import CONTEXT_CANDIDATES, CONTEXT_PACKING, pack_context
+from answer_cache import get_answer_cache
+from metrics import ANSWER_CACHE_LOOKUPS, PROMPT_TOKENS, QUERIES_EMBEDDED, stage
+
+SHARD_SEARCH_WORKERS = int(os.getenv('SHARD_SEARCH_WORKERS', '8'))
+# Vector hits fused with BM25 keyword hits by reciprocal rank fusion
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', 'true').lower() == 'true'
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+RRF_K = int(os.getenv('RRF_K', '60'))
+# /chat/batch: questions per request and answers generated at the same time
+CHAT_BATCH_MAX_QUESTIONS = int(os.getenv('CHAT_BATCH_MAX_QUESTIONS', '1000'))
+CHAT_BATCH_CONCURRENCY = int(os.getenv('CHAT_BATCH_CONCURRENCY', '8'))
+
+_holder_lock = threading.Lock()
+_vector_store_holders = {}
+_embeddings = {}
+_search_pool = None
 
-def extract_text_with_ocr(pdf_bytes, filename):
-    """Extract text from scanned PDF using OCR"""
-    try:
-        # Convert PDF to list of images
-        images = convert_from_bytes(pdf_bytes)
-        text = ""
-        
-        # Process OCR for each page
-        for i, image in enumerate(images):
-            # Use Vietnamese and English language packs
-            page_text = pytesseract.image_to_string(image, lang='vie+eng')
-            if page_text.strip():
-                text += f"\n--- Trang {i+1} ---\n{page_text}\n"
-        
-        return text.strip()
-    except Exception as e:
-        print(f"Lỗi khi xử lý OCR cho file {filename}: {str(e)}")
-        return ""
+def extract_pages_from_bytes(pdf_bytes, filename):
+    """Page texts of an in-memory PDF, OCRing pages without a text layer"""
+    return extract_pages([(pdf_bytes, filename)])[0]
 
 def get_pdf_text(pdf_docs):
-    text = ""
+    pdfs = []
     for pdf in pdf_docs:
         try:
             # Read PDF content into memory
-            pdf_bytes = pdf.file.read()
-            
-            # First try to extract text directly
-            try:
-                pdf_reader = PdfReader(BytesIO(pdf_bytes))
-                page_texts = []
-                has_text = False
-                
-                for page in pdf_reader.pages:
-                    page_content = page.extract_text()
-                    if page_content and page_content.strip():
-                        page_texts.append(page_content)
-                        has_text = True
-                    else:
-                        # If a page has no text, it might be a scanned page
-                        break
-                
-                if has_text and len(page_texts) == len(pdf_reader.pages):
-                    # All pages have text, use direct extraction
-                    text += "\n\n".join(page_texts) + "\n\n"
-                else:
-                    # Some or all pages are scanned, use OCR
-                    print(f"Phát hiện file scan, đang sử dụng OCR cho: {pdf.filename}")
-                    text += extract_text_with_ocr(pdf_bytes, pdf.filename) + "\n\n"
-                    
-            except Exception as e:
-                print(f"Lỗi khi đọc file {pdf.filename} bằng PyPDF2, đang thử dùng OCR: {str(e)}")
-                text += extract_text_with_ocr(pdf_bytes, pdf.filename) + "\n\n"
-                
+            pdfs.append((pdf.file.read(), pdf.filename))
         except Exception as e:
             print(f"Lỗi khi xử lý file {pdf.filename}: {str(e)}")
             continue
-            
+
+    # Files are extracted in parallel by the worker pool
+    text = "\n\n".join(t for t in extract_texts(pdfs) if t)
     return text.strip()
 
-def get_text_chunks(text, model_name):
-    if model_name == "Google AI":
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=1000)
-    chunks = text_splitter.split_text(text)
-    return chunks
+def get_text_chunks(text, model_name=None):
+    """Split text into chunks of CHUNK_SIZE_TOKENS tokens, whatever the chat model"""
+    return get_text_splitter().split_text(text)
+
+def get_embeddings(model_name, api_key=None):
+    """Return the shared embeddings object, wrapped with the embedding cache.
+
+    The backend comes from EMBEDDING_BACKEND rather than the chat model name.
+    """
+    key = (EMBEDDING_BACKEND, api_key)
+    if key not in _embeddings:
+        embeddings, model_id = create_embeddings(EMBEDDING_BACKEND, api_key)
+        store = get_embedding_store()
+        if store is not None:
+            embeddings = CachedEmbeddings(embeddings, model_id, store)
+        _embeddings[key] = embeddings
+    return _embeddings[key]
+
+def _load_store(path, shard, embeddings, writable=False):
+    return DiskVectorStore.load(path, get_chunk_store(INDEX_PATH), shard, mmap=not writable, embeddings=embeddings)
+
+def get_vector_store_holder(model_name, api_key=None, shard=SHARED_SHARD):
+    """Return the process-wide holder that keeps a shard's index loaded in memory"""
+    if shard not in _vector_store_holders:
+        with _holder_lock:
+            if shard not in _vector_store_holders:
+                embeddings = get_embeddings(model_name, api_key)
+                _vector_store_holders[shard] = VectorStoreHolder(
+                    lambda path, writable=False: _load_store(path, shard, embeddings, writable),
+                    path=shard_path(shard)
+                )
+    return _vector_store_holders[shard]
+
+def _index_lock(shard):
+    """Serializes read-modify-write cycles on the shard's on-disk index, also across processes"""
+    return _vector_store_holders[shard].write_lock()
+
+def _build_store(shard, texts, vectors, metadatas=None, dim=None, index_type=None, doc_ids=None):
+    """Store new chunks and create an index of the configured type for them"""
+    chunks = get_chunk_store(INDEX_PATH)
+    ids, doc_ids = chunks.add(texts, metadatas, doc_ids, shard=shard)
+    return DiskVectorStore.build(chunks, shard, ids, vectors, dim=dim, index_type=index_type), doc_ids
+
+def _rebuild_store(vector_store, embeddings, exclude_ids=(), index_type=None):
+    """Rebuild a store from its own chunks, e.g. to train a new index type or drop chunks"""
+    exclude_ids = set(exclude_ids)
+    ids = [int(i) for i in vector_store.ids() if int(i) not in exclude_ids]
+    vectors = vector_store.vectors(ids)
+    if vectors is None:
+        # Lossy index: embed again, which the embedding cache serves without API calls
+        docs = vector_store.chunks.get(ids)
+        ids = [i for i in ids if i in docs]
+        vectors = embeddings.embed_documents([docs[i].page_content for i in ids])
+    return DiskVectorStore.build(
+        vector_store.chunks, vector_store.shard, ids, vectors, dim=vector_store.index.d, index_type=index_type
+    )
+
+def _commit(holder, vector_store, removed_ids=()):
+    holder.commit(vector_store, vector_store.meta)
+    if removed_ids:
+        # Rows stay readable for snapshots taken before this commit until purged
+        vector_store.chunks.mark_deleted(removed_ids)
+    vector_store.chunks.purge_deleted()
+
+def migrate_legacy_index(model_name, api_key=None):
+    """Publish a converted version if the shared index still has a pickled LangChain docstore"""
+    holder = get_vector_store_holder(model_name, api_key)
+    with _index_lock(SHARED_SHARD):
+        version = holder.current_version()
+        if version is None or not holder.is_legacy(version):
+            return False
+        _commit(holder, holder.load_version(version))
+    return True
+
+def assign_chunk_shards(model_name, api_key=None):
+    """Record the shard of chunks stored before the docstore tracked shards"""
+    chunks = get_chunk_store(INDEX_PATH)
+    if not chunks.has_unassigned():
+        return
+    for shard in list_shards():
+        try:
+            store = get_vector_store_holder(model_name, api_key, shard).get().store
+        except FileNotFoundError:
+            continue
+        chunks.assign_shard(store.ids(), shard)
 
 def get_vector_store(text_chunks, model_name, api_key=None):
-    if model_name == "Google AI":
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=api_key)
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    vector_store.save_local("faiss_index")
+    embeddings = get_embeddings(model_name, api_key)
+    vectors = embeddings.embed_documents(text_chunks)
+    vector_store, _ = _build_store(SHARED_SHARD, text_chunks, vectors)
+    holder = get_vector_store_holder(model_name, api_key)
+    with _index_lock(SHARED_SHARD):
+        _commit(holder, vector_store)
     return vector_store
 
-def get_conversational_chain(model_name, vectorstore=None, api_key=None):
-    if model_name == "Google AI":
-        prompt_template = """
+def load_vector_store(model_name, api_key=None, shard=SHARED_SHARD):
+    """Return the in-memory snapshot of a shard's index.
+
+    Callers should hold on to the returned store for the whole request so a
+    concurrent reload does not change the data under them.
+    """
+    return get_vector_store_holder(model_name, api_key, shard).get().store
+
+def add_to_vector_store(text_chunks, model_name, api_key=None, metadatas=None, vectors=None, shard=SHARED_SHARD):
+    """Append chunks to the index, embedding them unless vectors are given.
+
+    The index is retrained with FAISS_INDEX_TYPE once the corpus is large enough.
+    Returns the doc ids of the new chunks so they can be removed later.
+    """
+    embeddings = get_embeddings(model_name, api_key)
+    if vectors is None:
+        vectors = embeddings.embed_documents(text_chunks)
+    holder = get_vector_store_holder(model_name, api_key, shard)
+    ids = [str(uuid.uuid4()) for _ in text_chunks]
+    with _index_lock(shard):
+        version = holder.current_version()
+        try:
+            if version is not None:
+                # Modify a private copy; the published snapshot stays untouched for readers
+                vector_store = holder.load_version(version)
+                vector_store.add_embeddings(text_chunks, vectors, metadatas=metadatas, doc_ids=ids)
+                if needs_rebuild(vector_store.meta, vector_store.ntotal):
+                    print(f"Đang build lại vector index với kiểu {FAISS_INDEX_TYPE}")
+                    vector_store = _rebuild_store(vector_store, embeddings)
+            else:
+                vector_store, _ = _build_store(shard, text_chunks, vectors, metadatas, doc_ids=ids)
+            _commit(holder, vector_store)
+        except Exception:
+            if holder.current_version() == version:
+                # Never published: the rows must not linger in the docstore and keyword search
+                chunks = get_chunk_store(INDEX_PATH)
+                chunks.mark_deleted(chunks.ids_for(ids))
+            raise
+    return ids
+
+def delete_from_vector_store(ids, model_name, api_key=None, shard=SHARED_SHARD):
+    """Remove previously added chunks from a shard's index"""
+    holder = get_vector_store_holder(model_name, api_key, shard)
+    with _index_lock(shard):
+        version = holder.current_version()
+        if not ids or version is None:
+            return
+        vector_store = holder.load_version(version)
+        row_ids = set(vector_store.chunks.ids_for(ids)) & {int(i) for i in vector_store.ids()}
+        if not row_ids:
+            return
+        if supports_remove(vector_store.meta):
+            vector_store.remove(sorted(row_ids))
+        else:
+            vector_store = _rebuild_store(
+                vector_store, get_embeddings(model_name, api_key), exclude_ids=row_ids
+            )
+        _commit(holder, vector_store, removed_ids=row_ids)
+
+def rebuild_vector_store(model_name, api_key=None, index_type=None, shard=SHARED_SHARD):
+    """Rebuild a shard's whole index with the given (or configured) index type"""
+    holder = get_vector_store_holder(model_name, api_key, shard)
+    with _index_lock(shard):
+        version = holder.current_version()
+        if version is None:
+            raise FileNotFoundError("No vector index to rebuild")
+        vector_store = _rebuild_store(
+            holder.load_version(version), get_embeddings(model_name, api_key), index_type=index_type
+        )
+        _commit(holder, vector_store)
+    return vector_store.meta
+
+QA_PROMPT_TEMPLATE = """
         Answer the question as detailed as possible from the provided context, make sure to provide all the details, if the answer is not in
         provided context just say, "answer is not available in the context", don't provide the wrong answer\n\n
         Context:\n {context}?\n
@@ -95,10 +231,228 @@ def get_conversational_chain(model_name, vectorstore=None, api_key=None):
 
         Answer:
         """
-        model = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3, google_api_key=api_key)
-        prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-        chain = load_qa_chain(model, chain_type="stuff", prompt=prompt)
-        return chain
+
+def get_qa_prompt():
+    return PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
+
+def get_chat_model(model_name, api_key=None):
+    if model_name == "Google AI":
+        return ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3, google_api_key=api_key)
+    if model_name == "Fake":
+        # Offline stand-in with a fixed latency, see fake_chat.py
+        from fake_chat import FakeChatModel
+        return FakeChatModel()
+    raise ValueError(f"Unsupported model: {model_name}")
+
+def format_qa_prompt(docs, question):
+    """Render the prompt the "stuff" chain would send for these documents"""
+    context = "\n\n".join(doc.page_content for doc in docs)
+    return get_qa_prompt().format(context=context, question=question)
+
+def get_conversational_chain(model_name, vectorstore=None, api_key=None):
+    model = get_chat_model(model_name, api_key)
+    chain = load_qa_chain(model, chain_type="stuff", prompt=get_qa_prompt())
+    return chain
+
+Retrieval = namedtuple("Retrieval", ["question", "version", "query_vector", "docs", "cached", "scope", "prompt_tokens"])
+QAResult = namedtuple("QAResult", ["answer", "sources", "cached", "prompt_tokens"])
+
+def document_sources(docs):
+    """File/chunk references of retrieved documents, without duplicates"""
+    sources = []
+    seen = set()
+    for doc in docs:
+        key = (doc.metadata.get("file_id"), doc.metadata.get("chunk"))
+        if key in seen:
+            continue
+        seen.add(key)
+        sources.append({
+            "file_id": doc.metadata.get("file_id"),
+            "filename": doc.metadata.get("filename"),
+            "chunk": doc.metadata.get("chunk"),
+            "page": doc.metadata.get("page"),
+        })
+    return sources
+
+def _shard_snapshots(model_name, api_key, shards):
+    snapshots = {}
+    for shard in shards:
+        try:
+            snapshots[shard] = get_vector_store_holder(model_name, api_key, shard).get()
+        except FileNotFoundError:
+            # Users who have not uploaded anything yet have no shard on disk
+            continue
+    if not snapshots:
+        raise FileNotFoundError("No vector index found for " + ", ".join(shards))
+    return snapshots
+
+def _get_search_pool():
+    global _search_pool
+    if _search_pool is None:
+        with _holder_lock:
+            if _search_pool is None:
+                _search_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+    return _search_pool
+
+def _fan_out(stores, search):
+    """Run search(store) for every store, in parallel when there are several; returns the results in order"""
+    if len(stores) == 1:
+        return [search(stores[0])]
+    futures = [_get_search_pool().submit(search, store) for store in stores]
+    return [future.result() for future in futures]
+
+def reciprocal_rank_fusion(rankings, k=4, rrf_k=RRF_K):
+    """Merge ranked lists of Documents; each list adds 1 / (rrf_k + rank) to a document's score"""
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(doc.id, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[doc_id] for doc_id in best]
+
+def _merge_hits(per_store, position):
+    """Hits of one query from every store, best (lowest) score first"""
+    return sorted((hit for hits in per_store for hit in hits[position]), key=lambda hit: hit[1])
+
+def search_shards_batch(snapshots, query_vectors, k=4, filter=None, questions=None):
+    """Search every shard snapshot for several queries; returns the k best chunks of each query.
+
+    Shards are searched in parallel, each with one FAISS call for all query
+    vectors. With HYBRID_SEARCH and questions, each vector ranking is fused
+    with the BM25 ranking of its question so exact codes and names are found
+    even when embeddings miss them.
+    """
+    stores = [snapshot.store for snapshot in snapshots.values()]
+    hybrid = HYBRID_SEARCH and questions is not None
+    fetch_k = max(k, HYBRID_CANDIDATES) if hybrid else k
+    # Every index uses L2 distance, so scores from different shards are comparable
+    vector_hits = _fan_out(stores, lambda store: store.similarity_search_with_score_by_vectors(query_vectors, fetch_k, filter))
+    if not hybrid:
+        return [[doc for doc, _ in _merge_hits(vector_hits, i)[:k]] for i in range(len(query_vectors))]
+    # All shards share one full-text index, so BM25 scores are comparable too
+    keyword_hits = _fan_out(
+        stores,
+        lambda store: [store.keyword_search_with_score(question, fetch_k, filter) if question else [] for question in questions]
+    )
+    return [
+        reciprocal_rank_fusion([
+            [doc for doc, _ in _merge_hits(vector_hits, i)[:fetch_k]],
+            [doc for doc, _ in _merge_hits(keyword_hits, i)[:fetch_k]],
+        ], k)
+        for i in range(len(query_vectors))
+    ]
+
+def search_shards(snapshots, query_vector, k=4, filter=None, question=None):
+    """Search every shard snapshot in parallel and merge the k best chunks"""
+    return search_shards_batch(snapshots, [query_vector], k, filter, [question] if question else None)[0]
+
+def _doc_vectors(snapshots, docs, embeddings):
+    """Stored vectors of retrieved docs, in order; chunks of lossy indexes are embedded again"""
+    chunks = next(iter(snapshots.values())).store.chunks
+    located = chunks.locate([doc.id for doc in docs])
+    vectors = [None] * len(docs)
+    by_shard = {}
+    for position, doc in enumerate(docs):
+        if doc.id in located:
+            row_id, shard = located[doc.id]
+            by_shard.setdefault(shard, []).append((position, row_id))
+    for shard, rows in by_shard.items():
+        snapshot = snapshots.get(shard)
+        try:
+            stored = snapshot.store.vectors([row_id for _, row_id in rows]) if snapshot is not None else None
+        except RuntimeError:
+            # A row written by an ingest that is not part of this version: embed the chunks instead
+            stored = None
+        if stored is None:
+            continue
+        for (position, _), vector in zip(rows, stored):
+            vectors[position] = vector
+    missing = [position for position, vector in enumerate(vectors) if vector is None]
+    if missing:
+        # Served from the embedding cache, these chunks were embedded when they were indexed
+        for position, vector in zip(missing, embeddings.embed_documents([docs[p].page_content for p in missing])):
+            vectors[position] = vector
+    return vectors
+
+def retrieve(question, model_name, api_key=None, shards=(SHARED_SHARD,), filter=None):
+    """Embed the question once, check the answer cache, then search the given shards.
+
+    filter restricts the search to chunks with matching metadata, e.g.
+    {"file_id": [...]}. On a cache hit ``cached`` holds the CachedAnswer and
+    ``docs`` is None. ``version`` identifies the shard versions searched, as
+    ((shard, version), ...). With CONTEXT_PACKING the candidates are packed
+    into the context token budget; ``prompt_tokens`` counts the prompt built
+    from ``docs``.
+    Raises FileNotFoundError when none of the shards has an index yet.
+    """
+    return retrieve_batch([question], model_name, api_key, shards, filter)[0]
+
+def retrieve_batch(questions, model_name, api_key=None, shards=(SHARED_SHARD,), filter=None):
+    """retrieve() for several questions: one embedding call, and one FAISS search per shard.
+
+    Returns one Retrieval per question, in order.
+    """
+    snapshots = _shard_snapshots(model_name, api_key, shards)
+    version = tuple(sorted((shard, snapshot.version) for shard, snapshot in snapshots.items()))
+    # Answers are only reused for questions asked with the same filter
+    scope = json.dumps(filter, sort_keys=True) if filter else None
+    embeddings = get_embeddings(model_name, api_key)
+    with stage("embed_query"):
+        query_vectors = embed_queries(embeddings, questions)
+    QUERIES_EMBEDDED.inc(len(questions))
+
+    cache = get_answer_cache()
+    cached = [None] * len(questions)
+    if cache is not None:
+        with stage("answer_cache"):
+            cached = [cache.lookup(vector, version, scope) for vector in query_vectors]
+        hits = sum(1 for hit in cached if hit is not None)
+        ANSWER_CACHE_LOOKUPS.inc(hits, result="hit")
+        ANSWER_CACHE_LOOKUPS.inc(len(questions) - hits, result="miss")
+    pending = [i for i, hit in enumerate(cached) if hit is None]
+    found = {}
+    if pending:
+        k = CONTEXT_CANDIDATES if CONTEXT_PACKING else 4
+        with stage("search"):
+            results = search_shards_batch(
+                snapshots, [query_vectors[i] for i in pending], k, filter, [questions[i] for i in pending]
+            )
+        found = dict(zip(pending, results))
+
+    retrievals = []
+    for i, question in enumerate(questions):
+        if cached[i] is not None:
+            retrievals.append(Retrieval(question, version, query_vectors[i], None, cached[i], scope, 0))
+            continue
+        docs = found[i]
+        if CONTEXT_PACKING and docs:
+            with stage("pack"):
+                docs = pack_context(docs, _doc_vectors(snapshots, docs, embeddings))
+        prompt_tokens = count_tokens(format_qa_prompt(docs, question))
+        retrievals.append(Retrieval(question, version, query_vectors[i], docs, None, scope, prompt_tokens))
+    return retrievals
+
+def remember_answer(retrieval, answer):
+    """Store a freshly generated answer in the semantic cache"""
+    cache = get_answer_cache()
+    if cache is not None and answer:
+        cache.store(retrieval.query_vector, retrieval.question, answer, document_sources(retrieval.docs), retrieval.version, retrieval.scope)
+
+def answer_question(question, model_name, api_key=None, shards=(SHARED_SHARD,), filter=None):
+    """Answer from the semantic cache if possible, otherwise with the "stuff" chain"""
+    retrieval = retrieve(question, model_name, api_key, shards, filter)
+    if retrieval.cached is not None:
+        return QAResult(retrieval.cached.answer, retrieval.cached.sources, True, 0)
+
+    chain = get_conversational_chain(model_name, api_key=api_key)
+    PROMPT_TOKENS.inc(retrieval.prompt_tokens)
+    with stage("llm"):
+        response = chain({"input_documents": retrieval.docs, "question": question}, return_only_outputs=True)
+    answer = response['output_text']
+    remember_answer(retrieval, answer)
+    return QAResult(answer, document_sources(retrieval.docs), False, retrieval.prompt_tokens)
 
 def user_input(user_question, model_name, api_key, pdf_docs, conversation_history):
     text_chunks = get_text_chunks(get_pdf_text(pdf_docs), model_name)
@@ -106,9 +460,8 @@ def user_input(user_question, model_name, api_key, pdf_docs, conversation_histor
     user_question_output = ""
     response_output = ""
     if model_name == "Google AI":
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=api_key)
-        new_db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-        docs = new_db.similarity_search(user_question)
+        new_db = load_vector_store(model_name, api_key)
+        docs = new_db.similarity_search_by_vector(get_embeddings(model_name, api_key).embed_query(user_question))
         chain = get_conversational_chain("Google AI", vectorstore=new_db, api_key=api_key)
         response = chain({"input_documents": docs, "question": user_question}, return_only_outputs=True)
         user_question_output = user_question
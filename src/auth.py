@@ -1,3 +1,21 @@
+"""
+Password hashing, JWT tokens and the current-user dependencies.
+
+Users resolved from a token are cached in memory for AUTH_CACHE_TTL_SECONDS,
+so an authenticated request needs no database round trip. Changes made
+through ``invalidate_user`` (e.g. disabling a user) apply immediately in this
+process; other worker processes pick them up when their entry expires.
+
+bcrypt is deliberately slow, so hashing and verification run on a pool of
+PASSWORD_HASH_WORKERS threads: a burst of logins queues there instead of
+blocking the event loop that serves chat traffic.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status, Request
@@ -6,6 +24,7 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from config import users
+from database import run_db
 from models.auth import TokenData, UserInDB, User
 
 # Configuration
@@ -13,10 +32,20 @@ SECRET_KEY = "your-secret-key-here"  # In production, use environment variables
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+AUTH_CACHE_TTL_SECONDS = float(os.getenv('AUTH_CACHE_TTL_SECONDS', '60'))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', '10000'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# username -> (UserInDB, expiry on the monotonic clock), least recently used first
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
 # Helper functions
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,16 +53,58 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
-def get_user(username: str) -> Optional[UserInDB]:
-    user_data = users.find_one({"username": username})
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the bcrypt thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the bcrypt thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, get_password_hash, password)
+
+def shutdown_password_executor():
+    _password_executor.shutdown(wait=False)
+
+def _cache_user(user: UserInDB):
+    with _user_cache_lock:
+        _user_cache[user.username] = (user, time.monotonic() + AUTH_CACHE_TTL_SECONDS)
+        _user_cache.move_to_end(user.username)
+        while len(_user_cache) > AUTH_CACHE_MAX_ENTRIES:
+            _user_cache.popitem(last=False)
+
+def invalidate_user(username: str):
+    """Forget a cached user, e.g. after it was disabled or changed"""
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
+
+async def get_user(username: str) -> Optional[UserInDB]:
+    user_data = await run_db(users.find_one, {"username": username})
     if user_data:
         return UserInDB(**user_data)
     return None
 
-def authenticate_user(username: str, password: str) -> Optional[UserInDB]:
-    user = get_user(username)
-    if not user or not verify_password(password, user.hashed_password):
+async def get_cached_user(username: str) -> Optional[UserInDB]:
+    """get_user, served from the in-memory cache while the entry is fresh"""
+    if AUTH_CACHE_TTL_SECONDS > 0:
+        with _user_cache_lock:
+            entry = _user_cache.get(username)
+            if entry is not None and entry[1] > time.monotonic():
+                _user_cache.move_to_end(username)
+                return entry[0]
+    user = await get_user(username)
+    # Unknown users are not cached, so a user who registers next is found at once
+    if user is not None and AUTH_CACHE_TTL_SECONDS > 0:
+        _cache_user(user)
+    return user
+
+async def authenticate_user(username: str, password: str) -> Optional[UserInDB]:
+    # Always read the stored hash, never a cached one
+    user = await get_user(username)
+    if not user or not await verify_password_async(password, user.hashed_password):
         return None
+    if AUTH_CACHE_TTL_SECONDS > 0:
+        _cache_user(user)
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -61,7 +132,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user = get_user(username=token_data.username)
+    user = await get_cached_user(token_data.username)
     if user is None:
         raise credentials_exception
     return user
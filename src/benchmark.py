@@ -0,0 +1,393 @@
+"""
+Offline end-to-end benchmark of the API.
+
+Runs the real FastAPI app (config.py + api.py) under uvicorn in this process,
+with mongomock instead of MongoDB, the fake embedder and a fake chat model
+that answers after --llm-latency-ms, so neither Atlas nor Gemini is needed:
+
+    python benchmark.py --text-pdfs 20 --scanned-pdfs 4 --concurrency 1,8,32 --json benchmark.json
+
+Generated PDF corpora, one with a text layer and one of scanned page images,
+are uploaded through /upload-pdfs/ and timed until their ingestion jobs
+finish (pages/s). Retrieval is timed in process, then /chat and /user/chat
+are loaded with each concurrency level and their p50/p95/p99 latencies
+recorded. The scanned corpus needs tesseract and poppler; it is skipped
+when they are not installed. Pass --mongodb-uri to use a local mongod
+instead of mongomock.
+
+Every setting comes from the environment as usual, so runs can compare
+e.g. FAISS_INDEX_TYPE or INGEST_CONCURRENCY; the answer cache is disabled
+unless ANSWER_CACHE_ENABLED is set. Peak RSS covers this process (server
+and load generator) and, separately, the PDF extraction workers.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+WORDS = (
+    "hop dong lao dong bao hiem xa hoi thue thu nhap ca nhan nghi phep luong thuong ky luat "
+    "quy trinh phe duyet ngan sach du an bao cao tai chinh kiem toan noi bo chinh sach bao mat "
+    "du lieu khach hang dich vu ho tro ky thuat dao tao nhan vien danh gia hieu qua cong viec"
+).split()
+PAGE_LINES = 40
+LINE_WORDS = 12
+
+
+def generate_pages(rng, count):
+    """Page texts made of random sentences, each page carrying a few document codes"""
+    pages = []
+    for _ in range(count):
+        lines = []
+        for _ in range(PAGE_LINES):
+            words = rng.choices(WORDS, k=LINE_WORDS)
+            if rng.random() < 0.1:
+                words.append(f"QD-{rng.randint(1000, 9999)}")
+            lines.append(" ".join(words))
+        pages.append(lines)
+    return pages
+
+
+def _pdf_string(text):
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def text_pdf(pages):
+    """Minimal PDF with a Helvetica text layer, one page per list of lines"""
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"{_pdf_string(line)} '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode("latin-1"))
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {len(objects)} 0 R "
+            f"/Resources << /Font << /F1 3 0 R >> >> >>".encode("latin-1")
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode("latin-1")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def scanned_pdf(pages, dpi=150):
+    """PDF of page images without a text layer, as a scanner produces"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    try:
+        font = ImageFont.load_default(size=22)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    images = []
+    for lines in pages:
+        image = Image.new("L", (int(8.27 * dpi), int(11.69 * dpi)), 255)
+        draw = ImageDraw.Draw(image)
+        for row, line in enumerate(lines):
+            draw.text((60, 60 + row * 40), line, fill=0, font=font)
+        images.append(image)
+    out = io.BytesIO()
+    images[0].save(out, "PDF", save_all=True, append_images=images[1:], resolution=dpi)
+    return out.getvalue()
+
+
+def make_questions(rng, corpus, count):
+    questions = []
+    for _ in range(count):
+        lines = rng.choice(rng.choice(corpus))
+        words = rng.choice(lines).split()
+        start = rng.randrange(max(1, len(words) - 5))
+        questions.append("Tài liệu nói gì về " + " ".join(words[start:start + 5]) + "?")
+    return questions
+
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return None
+    values = np.asarray(samples_ms)
+    return {
+        "count": len(samples_ms),
+        "mean": round(float(values.mean()), 1),
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "max": round(float(values.max()), 1),
+    }
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def configure_environment(args, workdir):
+    """Point every backend at local stand-ins before config.py is imported"""
+    defaults = {
+        "EMBEDDING_BACKEND": "fake",
+        "MODEL_NAME": "Fake",
+        "API_KEY": "offline",
+        "SECRET_KEY": "benchmark",
+        "FAISS_INDEX_PATH": os.path.join(workdir, "faiss_index"),
+        "OCR_CACHE_DIR": os.path.join(workdir, "ocr_cache"),
+        "ANSWER_CACHE_ENABLED": "false",
+        "INDEX_RELOAD_CHECK_INTERVAL": "0",
+        "INGEST_POLL_INTERVAL": "0.2",
+        "MONGODB_URI": args.mongodb_uri or "mongodb://localhost:27017",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    if args.mongodb_uri:
+        os.environ["MONGODB_URI"] = args.mongodb_uri
+        return
+    try:
+        import mongomock
+        import mongomock.gridfs
+    except ImportError:
+        sys.exit("mongomock chưa được cài đặt: pip install mongomock (hoặc dùng --mongodb-uri)")
+    import pymongo
+
+    mongomock.gridfs.enable_gridfs_integration()
+    pymongo.MongoClient = mongomock.MongoClient
+
+
+def start_server(app, port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            sys.exit("Không thể khởi động API server")
+        time.sleep(0.05)
+    return server, thread
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def login(http, base_url, username, admin=False):
+    import config
+
+    password = "benchmark-password"
+    http.post(f"{base_url}/register/", json={
+        "username": username, "email": f"{username}@benchmark.local", "password": password, "full_name": username
+    })
+    if admin:
+        config.db.users.update_one({"username": username}, {"$set": {"is_admin": True}})
+    response = http.post(f"{base_url}/login/", json={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def run_ingest(http, base_url, headers, label, pdfs, pages_per_pdf, timeout):
+    """Upload a corpus to the shared shard and wait for every ingestion job"""
+    started = time.perf_counter()
+    files = [("files", (name, data, "application/pdf")) for name, data in pdfs]
+    response = http.post(f"{base_url}/upload-pdfs/", files=files, data={"shared": "true"}, headers=headers)
+    response.raise_for_status()
+    job_ids = [item["job_id"] for item in response.json()["uploaded_files"] if item.get("job_id")]
+
+    pending = set(job_ids)
+    statuses = {}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for job_id in list(pending):
+            job = http.get(f"{base_url}/ingest-jobs/{job_id}", headers=headers).json()
+            if job["status"] in ("done", "failed", "cancelled"):
+                statuses[job_id] = job
+                pending.discard(job_id)
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    done = [job for job in statuses.values() if job["status"] == "done"]
+    errors = sorted({job.get("error") for job in statuses.values() if job["status"] != "done"} - {None})
+    pages = len(done) * pages_per_pdf
+    return {
+        "corpus": label,
+        "files": len(pdfs),
+        "pages": len(pdfs) * pages_per_pdf,
+        "files_indexed": len(done),
+        "files_failed": len(statuses) - len(done),
+        "files_timed_out": len(pending),
+        "chunks": sum(job.get("chunk_count") or 0 for job in done),
+        "seconds": round(elapsed, 2),
+        "pages_per_second": round(pages / elapsed, 2) if elapsed else None,
+        "errors": errors[:5],
+    }
+
+
+def time_retrieval(questions):
+    from app import retrieve
+
+    model_name = os.getenv('MODEL_NAME')
+    api_key = os.getenv('API_KEY')
+    retrieve(questions[0], model_name, api_key)  # warm up the index snapshot
+    samples = []
+    for question in questions:
+        started = time.perf_counter()
+        retrieve(question, model_name, api_key)
+        samples.append((time.perf_counter() - started) * 1000)
+    return percentiles(samples)
+
+
+def run_load(base_url, path, headers, questions, concurrency, requests_count):
+    """Send requests_count chat requests from concurrency client threads"""
+    import requests
+
+    local = threading.local()
+
+    def send(question):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = session.post(f"{base_url}{path}", json={"question": question}, headers=headers, timeout=300).ok
+        except requests.RequestException:
+            ok = False
+        return ok, (time.perf_counter() - started) * 1000
+
+    batch = [questions[i % len(questions)] for i in range(requests_count)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, batch))
+    elapsed = time.perf_counter() - started
+    return {
+        "endpoint": path,
+        "concurrency": concurrency,
+        "requests": requests_count,
+        "errors": sum(1 for ok, _ in results if not ok),
+        "requests_per_second": round(requests_count / elapsed, 2),
+        "latency_ms": percentiles([ms for ok, ms in results if ok]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--text-pdfs", type=int, default=20)
+    parser.add_argument("--scanned-pdfs", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10, help="pages per PDF")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint and concurrency level")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--ingest-timeout", type=float, default=600, help="seconds to wait for a corpus to be indexed")
+    parser.add_argument("--mongodb-uri", help="local MongoDB to use instead of mongomock")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+
+    workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    configure_environment(args, workdir)
+    import requests
+
+    import api  # noqa: F401  registers the routes on config.app
+    import config
+
+    rng = random.Random(args.seed)
+    text_pages = [generate_pages(rng, args.pages) for _ in range(args.text_pdfs)]
+    scanned_pages = [generate_pages(rng, args.pages) for _ in range(args.scanned_pdfs)]
+    questions = make_questions(rng, text_pages + scanned_pages, args.questions)
+
+    server, thread = start_server(config.app, free_port())
+    base_url = f"http://127.0.0.1:{server.config.port}"
+    http = requests.Session()
+    results = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "settings": {key: os.getenv(key) for key in (
+            "EMBEDDING_BACKEND", "FAISS_INDEX_TYPE", "INGEST_CONCURRENCY", "PDF_EXTRACT_WORKERS",
+            "CHUNK_SIZE_TOKENS", "CONTEXT_TOKEN_BUDGET", "HYBRID_SEARCH", "ANSWER_CACHE_ENABLED",
+        )},
+        "ingest": [],
+        "load": [],
+    }
+    try:
+        admin = login(http, base_url, "bench-admin", admin=True)
+        user = login(http, base_url, "bench-user")
+
+        print(f"Ingest {args.text_pdfs} PDF có text layer ({args.pages} trang mỗi file)")
+        pdfs = [(f"text-{i}.pdf", text_pdf(pages)) for i, pages in enumerate(text_pages)]
+        results["ingest"].append(run_ingest(http, base_url, admin, "text", pdfs, args.pages, args.ingest_timeout))
+        if args.scanned_pdfs:
+            if shutil.which("tesseract") and shutil.which("pdftoppm"):
+                print(f"Ingest {args.scanned_pdfs} PDF scan ({args.pages} trang mỗi file)")
+                pdfs = [(f"scanned-{i}.pdf", scanned_pdf(pages)) for i, pages in enumerate(scanned_pages)]
+                results["ingest"].append(
+                    run_ingest(http, base_url, admin, "scanned", pdfs, args.pages, args.ingest_timeout)
+                )
+            else:
+                print("Bỏ qua PDF scan: cần cài tesseract và poppler")
+                results["ingest"].append({"corpus": "scanned", "skipped": "tesseract/poppler not installed"})
+
+        print(f"Đo retrieval với {len(questions)} câu hỏi")
+        results["retrieval_ms"] = time_retrieval(questions)
+
+        for path, headers in (("/chat", {}), ("/user/chat", user)):
+            for level in levels:
+                print(f"Tải {path} với {level} client đồng thời")
+                results["load"].append(run_load(base_url, path, headers, questions, level, args.requests))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    # Extraction workers are only counted once they have exited, i.e. after shutdown
+    results["peak_rss_mb_extraction_workers"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+    for ingest in results["ingest"]:
+        if "skipped" in ingest:
+            print(f"ingest {ingest['corpus']:<8} skipped: {ingest['skipped']}")
+            continue
+        print(f"ingest {ingest['corpus']:<8} {ingest['pages']:>5} pages {ingest['seconds']:>8}s "
+              f"{ingest['pages_per_second']:>8} pages/s  failed {ingest['files_failed']}")
+    retrieval = results["retrieval_ms"]
+    print(f"retrieval ms: p50 {retrieval['p50']}  p95 {retrieval['p95']}  p99 {retrieval['p99']}")
+    print(f"{'endpoint':<12} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for load in results["load"]:
+        latency = load["latency_ms"] or {}
+        print(f"{load['endpoint']:<12} {load['concurrency']:>5} {load['requests_per_second']:>8} "
+              f"{latency.get('p50', '-'):>8} {latency.get('p95', '-'):>8} {latency.get('p99', '-'):>8} {load['errors']:>7}")
+    print(f"peak RSS: {results['peak_rss_mb']} MB (API + clients), "
+          f"{results['peak_rss_mb_extraction_workers']} MB (extraction workers)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Token-sized, page-anchored chunking.
+
+Chunks are sized in tokens rather than characters (CHUNK_SIZE_TOKENS with
+CHUNK_OVERLAP_TOKENS of overlap), which bounds what a retrieved chunk adds
+to the prompt. Tokens are counted with tiktoken when CHUNK_TOKENIZER=tiktoken
+and it is installed, otherwise estimated as one token per four characters.
+
+Pages are split as one text so chunks can run across page breaks, but each
+chunk records the page it starts on and the page it ends on (1-based), which
+ties it back to the text layer or OCR result of those pages.
+"""
+import bisect
+import math
+import os
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE_TOKENS = int(os.getenv('CHUNK_SIZE_TOKENS', '512'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '64'))
+CHUNK_TOKENIZER = os.getenv('CHUNK_TOKENIZER', 'approx')
+
+PAGE_SEPARATOR = "\n\n"
+
+_encoding = None
+
+
+def _approx_tokens(text):
+    return math.ceil(len(text) / 4)
+
+
+def get_token_counter(tokenizer=CHUNK_TOKENIZER):
+    """Return a callable counting the tokens of a text"""
+    global _encoding
+    if tokenizer == "tiktoken":
+        try:
+            import tiktoken
+        except ImportError:
+            print("tiktoken chưa được cài đặt, ước lượng số token theo số ký tự")
+            return _approx_tokens
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(_encoding.encode(text, disallowed_special=()))
+    if tokenizer != "approx":
+        raise ValueError(f"Unknown CHUNK_TOKENIZER: {tokenizer}")
+    return _approx_tokens
+
+
+count_tokens = get_token_counter()
+
+
+def get_text_splitter(chunk_size=CHUNK_SIZE_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS, length_function=None):
+    """Splitter measuring chunk_size and chunk_overlap in tokens, or with length_function if given"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=length_function or count_tokens,
+    )
+
+
+def chunk_pages(pages, chunk_size=CHUNK_SIZE_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS, length_function=None):
+    """Split the page texts of one document into chunks.
+
+    Returns:
+        (chunks, metadatas) where each metadata holds the chunk's "page" and "page_end"
+    """
+    starts = []
+    parts = []
+    offset = 0
+    for number, text in enumerate(pages, start=1):
+        text = text.strip()
+        if not text:
+            continue
+        starts.append((offset, number))
+        parts.append(text)
+        offset += len(text) + len(PAGE_SEPARATOR)
+    if not parts:
+        return [], []
+
+    offsets = [start for start, _ in starts]
+    text = PAGE_SEPARATOR.join(parts)
+    chunks = get_text_splitter(chunk_size, chunk_overlap, length_function).split_text(text)
+    metadatas = []
+    start = -1
+    for chunk in chunks:
+        # Chunks come out in order, each starting after the previous one
+        # (add_start_index assumes the overlap is measured in characters)
+        found = text.find(chunk, start + 1)
+        start = found if found != -1 else start + 1
+        end = start + len(chunk) - 1
+        metadatas.append({
+            "page": starts[bisect.bisect_right(offsets, start) - 1][1],
+            "page_end": starts[bisect.bisect_right(offsets, end) - 1][1],
+        })
+    return chunks, metadatas
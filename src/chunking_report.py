@@ -0,0 +1,123 @@
+"""
+Prompt size and answer latency for different chunking settings.
+
+Chunks the given PDFs with every candidate setting, indexes each result in a
+temporary store and runs the questions against it:
+
+    python chunking_report.py docs/*.pdf --questions questions.txt --json chunking_report.json
+
+Prompt size is always measured. Answer latency is measured with --llm, which
+sends every prompt to the chat model (API_KEY must be set). Embeddings go
+through the embedding cache, so repeated runs do not embed the same chunk
+twice.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app import format_qa_prompt, get_chat_model, get_embeddings, search_shards
+from chunking import chunk_pages, count_tokens
+from docstore import ChunkStore, DiskVectorStore
+from extraction import extract_pages
+from vector_store import Snapshot
+
+CANDIDATES = [
+    # The splitter used before chunking was configurable: 10000 characters, 1000 overlap
+    ("chars-10000", 10000, 1000, len),
+    ("tokens-256", 256, 32, None),
+    ("tokens-512", 512, 64, None),
+    ("tokens-1024", 1024, 128, None),
+]
+
+
+def build_store(directory, documents, chunk_size, chunk_overlap, length_function, embeddings):
+    chunks = ChunkStore(os.path.join(directory, "docstore.sqlite"))
+    texts = []
+    metadatas = []
+    for filename, pages in documents:
+        doc_chunks, doc_metadatas = chunk_pages(pages, chunk_size, chunk_overlap, length_function)
+        texts.extend(doc_chunks)
+        metadatas.extend({"filename": filename, "chunk": i, **m} for i, m in enumerate(doc_metadatas))
+    ids, _ = chunks.add(texts, metadatas, shard="report")
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype="float32")
+    return DiskVectorStore.build(chunks, "report", ids, vectors, index_type="flat"), texts
+
+
+def evaluate(label, documents, questions, chunk_size, chunk_overlap, length_function, k, model, embeddings):
+    with tempfile.TemporaryDirectory() as directory:
+        store, texts = build_store(directory, documents, chunk_size, chunk_overlap, length_function, embeddings)
+        snapshots = {"report": Snapshot(store, 0)}
+        prompt_chars, prompt_tokens, retrieval_ms, answer_ms = [], [], [], []
+        for question in questions:
+            started = time.perf_counter()
+            docs = search_shards(snapshots, embeddings.embed_query(question), k, question=question)
+            retrieval_ms.append((time.perf_counter() - started) * 1000)
+
+            prompt = format_qa_prompt(docs, question)
+            prompt_chars.append(len(prompt))
+            prompt_tokens.append(count_tokens(prompt))
+            if model is not None:
+                started = time.perf_counter()
+                model.invoke(prompt)
+                answer_ms.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        "setting": label,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "unit": "chars" if length_function is len else "tokens",
+        "chunks": len(texts),
+        "prompt_chars_mean": round(float(np.mean(prompt_chars)), 1),
+        "prompt_tokens_mean": round(float(np.mean(prompt_tokens)), 1),
+        "retrieval_ms_mean": round(float(np.mean(retrieval_ms)), 2),
+    }
+    if answer_ms:
+        result["answer_ms_mean"] = round(float(np.mean(answer_ms)), 1)
+        result["answer_ms_p95"] = round(float(np.percentile(answer_ms, 95)), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--questions", required=True, help="text file with one question per line")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--llm", action="store_true", help="also time answers from the chat model")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    model_name = os.getenv('MODEL_NAME', 'Google AI')
+    api_key = os.getenv('API_KEY')
+    with open(args.questions, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    pdfs = []
+    for path in args.pdfs:
+        with open(path, "rb") as f:
+            pdfs.append((f.read(), os.path.basename(path)))
+    documents = [(filename, pages) for (_, filename), pages in zip(pdfs, extract_pages(pdfs))]
+
+    embeddings = get_embeddings(model_name, api_key)
+    model = get_chat_model(model_name, api_key) if args.llm else None
+    results = [
+        evaluate(label, documents, questions, size, overlap, length_function, args.k, model, embeddings)
+        for label, size, overlap, length_function in CANDIDATES
+    ]
+
+    print(f"{len(documents)} PDFs, {len(questions)} questions, k={args.k}")
+    print(f"{'setting':<14} {'chunks':>7} {'prompt chars':>13} {'prompt tokens':>14} {'search ms':>10} {'answer ms':>10} {'p95 ms':>8}")
+    for r in results:
+        print(f"{r['setting']:<14} {r['chunks']:>7} {r['prompt_chars_mean']:>13} {r['prompt_tokens_mean']:>14} "
+              f"{r['retrieval_ms_mean']:>10} {r.get('answer_ms_mean', '-'):>10} {r.get('answer_ms_p95', '-'):>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"pdfs": [name for _, name in pdfs], "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 import os
 from urllib.parse import quote_plus
@@ -13,6 +14,16 @@ MONGODB_URI = os.getenv('MONGODB_URI')
 DB_NAME = os.getenv('DB_NAME', 'pdf_chatbot')
 COLLECTION_NAME = os.getenv('COLLECTION_NAME', 'pdf_files')
 
+# Connection pool and timeouts (milliseconds)
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '10000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000'))
+# Threads that run blocking pymongo calls for the async endpoints
+MONGO_EXECUTOR_WORKERS = int(os.getenv('MONGO_EXECUTOR_WORKERS', '32'))
+
 # API configuration
 API_KEY = os.getenv('API_KEY')
 MODEL_NAME = os.getenv('MODEL_NAME', 'Google AI')
@@ -43,7 +54,15 @@ if len(uri_parts) > 1:
 
 # Initialize MongoDB client and collections
 try:
-    client = MongoClient(MONGODB_URI)
+    client = MongoClient(
+        MONGODB_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    )
     db = client[DB_NAME]
     
     # Collections
@@ -54,8 +73,20 @@ try:
     # Create indexes for better query performance
     users.create_index("username", unique=True)
     users.create_index("email", unique=True)
-    conversations.create_index("user_id")
-    conversations.create_index("timestamp")
+    # Newest-first history pages of one user and of everyone (conversations.py)
+    conversations.create_index([("user_id", 1), ("timestamp", -1), ("_id", -1)])
+    conversations.create_index([("timestamp", -1), ("_id", -1)])
+    db.files.create_index("file_id")
+    # Unique so concurrent uploads of the same content cannot both store it (storage.py);
+    # blobs stored before deduplication have no sha256
+    fs_indexes = db.fs.files.index_information()
+    if "sha256_1" in fs_indexes and not fs_indexes["sha256_1"].get("unique"):
+        db.fs.files.drop_index("sha256_1")
+    try:
+        db.fs.files.create_index("sha256", unique=True, partialFilterExpression={"sha256": {"$exists": True}})
+    except DuplicateKeyError as e:
+        print(f"GridFS đã có các blob trùng sha256, dùng index không unique: {str(e)}")
+        db.fs.files.create_index("sha256")
     
     # Test connection
     client.server_info()
@@ -0,0 +1,72 @@
+"""
+Context assembly between retrieval and the "stuff" chain.
+
+Retrieval over-fetches CONTEXT_CANDIDATES chunks. They are re-ordered by
+maximal marginal relevance on their stored vectors, so a chunk that mostly
+repeats one already chosen (overlapping neighbours, the same file uploaded
+twice) falls behind chunks that add something new; chunks at least
+CONTEXT_DUPLICATE_THRESHOLD cosine-similar to a chosen one are dropped. The
+rest fill the context in that order until CONTEXT_TOKEN_BUDGET is reached.
+
+Relevance is the chunk's position in the retrieval ranking rather than its
+vector similarity to the question, so keyword hits from hybrid search keep
+their place.
+"""
+import os
+
+import numpy as np
+
+from chunking import count_tokens
+
+CONTEXT_PACKING = os.getenv('CONTEXT_PACKING', 'true').lower() == 'true'
+CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', '12'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.7'))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', '0.95'))
+
+
+def mmr_order(vectors, lambda_mult=MMR_LAMBDA, duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    """Positions of the ranked vectors in MMR order, near-duplicates left out"""
+    vectors = np.asarray(vectors, dtype="float32")
+    n = len(vectors)
+    if n == 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+    similarity = unit @ unit.T
+    # Rank 0 is the best retrieval hit
+    relevance = 1.0 - np.arange(n, dtype="float32") / n
+
+    order = [0]
+    closest = similarity[0].copy()
+    remaining = np.ones(n, dtype=bool)
+    remaining[0] = False
+    remaining &= closest < duplicate_threshold
+    while remaining.any():
+        scores = np.where(remaining, lambda_mult * relevance - (1 - lambda_mult) * closest, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        remaining[best] = False
+        closest = np.maximum(closest, similarity[best])
+        remaining &= closest < duplicate_threshold
+    return order
+
+
+def pack_context(docs, vectors, budget=CONTEXT_TOKEN_BUDGET, lambda_mult=MMR_LAMBDA,
+                 duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    """Pick from ranked docs the chunks that fit in budget tokens.
+
+    vectors holds the stored vector of each doc, in the same order. The best
+    ranked chunk is always kept, even if it alone exceeds the budget.
+    """
+    packed = []
+    used = 0
+    for position in mmr_order(vectors, lambda_mult, duplicate_threshold):
+        doc = docs[position]
+        tokens = count_tokens(doc.page_content)
+        if packed and used + tokens > budget:
+            # A shorter chunk further down may still fit
+            continue
+        packed.append(doc)
+        used += tokens
+    return packed
@@ -0,0 +1,123 @@
+"""
+Write-behind logging of conversations.
+
+Chat endpoints hand each finished conversation to ``log_conversation``, which
+only puts it on an in-process queue; a writer task stores queued
+conversations with one ``insert_many`` per CONVERSATION_FLUSH_SIZE entries or
+every CONVERSATION_FLUSH_INTERVAL seconds, whichever comes first, so answers
+no longer wait for a MongoDB round trip.
+
+The queue holds at most CONVERSATION_QUEUE_SIZE conversations. When MongoDB
+falls behind and it fills up, CONVERSATION_QUEUE_FULL decides what happens:
+``block`` makes new conversations wait for room (chat requests slow down with
+the database), ``drop`` discards them and counts them as dropped. A failed
+flush is retried CONVERSATION_FLUSH_RETRIES times before its conversations
+are counted as failed. Stopping the writer drains the queue, so a normal
+shutdown loses nothing; a crash loses what was still queued.
+"""
+import asyncio
+import os
+import time
+
+from pymongo.errors import BulkWriteError
+
+from config import db
+from database import run_db
+from metrics import CONVERSATION_FLUSH_SECONDS, CONVERSATION_QUEUE_DEPTH, CONVERSATIONS_LOGGED
+
+CONVERSATION_QUEUE_SIZE = int(os.getenv('CONVERSATION_QUEUE_SIZE', '10000'))
+CONVERSATION_FLUSH_SIZE = int(os.getenv('CONVERSATION_FLUSH_SIZE', '100'))
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv('CONVERSATION_FLUSH_INTERVAL', '1'))
+CONVERSATION_FLUSH_RETRIES = int(os.getenv('CONVERSATION_FLUSH_RETRIES', '3'))
+CONVERSATION_QUEUE_FULL = os.getenv('CONVERSATION_QUEUE_FULL', 'block').lower()
+
+_STOP = object()
+_queue = None
+_writer = None
+
+
+async def log_conversation(conversation):
+    """Queue a conversation document for writing"""
+    if _writer is None:
+        # Writer not running (scripts, shutdown): write directly
+        await run_db(db.conversations.insert_one, conversation)
+        CONVERSATIONS_LOGGED.inc(result="written")
+        return
+    if CONVERSATION_QUEUE_FULL == "drop":
+        try:
+            _queue.put_nowait(conversation)
+        except asyncio.QueueFull:
+            CONVERSATIONS_LOGGED.inc(result="dropped")
+            return
+    else:
+        await _queue.put(conversation)
+    CONVERSATION_QUEUE_DEPTH.set(_queue.qsize())
+
+
+async def _flush(batch):
+    for attempt in range(CONVERSATION_FLUSH_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            await run_db(db.conversations.insert_many, batch, ordered=False)
+            CONVERSATION_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            CONVERSATIONS_LOGGED.inc(len(batch), result="written")
+            return
+        except BulkWriteError as e:
+            # Unordered: everything but the reported errors was inserted
+            written = e.details.get("nInserted", 0)
+            CONVERSATIONS_LOGGED.inc(written, result="written")
+            CONVERSATIONS_LOGGED.inc(len(batch) - written, result="failed")
+            print(f"Lỗi khi ghi {len(batch) - written} conversation: {str(e)}")
+            return
+        except Exception as e:
+            if attempt == CONVERSATION_FLUSH_RETRIES:
+                CONVERSATIONS_LOGGED.inc(len(batch), result="failed")
+                print(f"Không ghi được {len(batch)} conversation sau {attempt + 1} lần thử: {str(e)}")
+                return
+            print(f"Lỗi khi ghi conversation, thử lại: {str(e)}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+
+async def _write_behind():
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        batch = [await _queue.get()]
+        deadline = loop.time() + CONVERSATION_FLUSH_INTERVAL
+        while len(batch) < CONVERSATION_FLUSH_SIZE and batch[-1] is not _STOP:
+            try:
+                batch.append(_queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        if batch[-1] is _STOP:
+            batch.pop()
+            stopping = True
+        CONVERSATION_QUEUE_DEPTH.set(_queue.qsize())
+        if batch:
+            await _flush(batch)
+
+
+def start_conversation_writer():
+    global _queue, _writer
+    _queue = asyncio.Queue(maxsize=CONVERSATION_QUEUE_SIZE)
+    _writer = asyncio.create_task(_write_behind())
+
+
+async def stop_conversation_writer():
+    """Write every queued conversation, then stop the writer"""
+    global _writer
+    if _writer is None:
+        return
+    writer, _writer = _writer, None
+    # Conversations queued before the marker are still written
+    await _queue.put(_STOP)
+    await writer
+    CONVERSATION_QUEUE_DEPTH.set(0)
@@ -0,0 +1,143 @@
+"""
+Conversation history queries.
+
+Conversations are read newest first with keyset pagination: a page ends with
+an opaque cursor holding the (timestamp, _id) of its last conversation, and
+the next page starts strictly after it. Each page is one range scan on the
+``(user_id, timestamp, _id)`` or ``(timestamp, _id)`` index, however deep
+into the history it is, unlike skip() which walks every earlier entry.
+
+``timestamp`` is a UTC datetime. Conversations saved before that stored it
+as a local-time "YYYY-MM-DD HH:MM:SS" string, which sorts differently from
+dates; migrate_conversation_timestamps converts them at startup. Entries
+whose timestamp is missing or unreadable get the creation time of their
+ObjectId instead, so no entry falls outside the keyset order.
+"""
+import base64
+import itertools
+import json
+import os
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+from config import db
+from database import run_db
+
+CONVERSATION_PAGE_MAX = int(os.getenv('CONVERSATION_PAGE_MAX', '100'))
+CONVERSATION_EXPORT_BATCH = int(os.getenv('CONVERSATION_EXPORT_BATCH', '500'))
+
+# Fields returned by the history endpoints and the export
+CONVERSATION_FIELDS = {"user_id": 1, "question": 1, "answer": 1, "timestamp": 1, "model_name": 1}
+NEWEST_FIRST = [("timestamp", -1), ("_id", -1)]
+
+
+def encode_cursor(conversation):
+    """Opaque cursor pointing after conversation"""
+    raw = f"{conversation['timestamp'].isoformat()}|{conversation['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(timestamp, _id) of a cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, object_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), ObjectId(object_id)
+    except (ValueError, UnicodeDecodeError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+
+def _after(cursor):
+    timestamp, object_id = decode_cursor(cursor)
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$lt": object_id}},
+    ]}
+
+
+async def conversation_page(user_id=None, cursor=None, limit=10):
+    """
+    One page of conversations, newest first, of one user or of everyone.
+    Returns (conversations, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, CONVERSATION_PAGE_MAX))
+    query = {}
+    if user_id is not None:
+        query["user_id"] = user_id
+    if cursor:
+        query.update(_after(cursor))
+
+    def _query():
+        # One extra row tells whether there is a next page without counting
+        return list(db.conversations.find(query, CONVERSATION_FIELDS).sort(NEWEST_FIRST).limit(limit + 1))
+
+    conversations = await run_db(_query)
+    next_cursor = encode_cursor(conversations[limit - 1]) if len(conversations) > limit else None
+    return conversations[:limit], next_cursor
+
+
+async def iter_conversations(user_id=None, batch_size=CONVERSATION_EXPORT_BATCH):
+    """
+    Yield conversations newest first from a single Mongo cursor, fetching
+    batch_size at a time on the database executor, so the whole history is
+    never held in memory.
+    """
+    query = {} if user_id is None else {"user_id": user_id}
+    cursor = db.conversations.find(query, CONVERSATION_FIELDS).sort(NEWEST_FIRST).batch_size(batch_size)
+    try:
+        while True:
+            batch = await run_db(lambda: list(itertools.islice(cursor, batch_size)))
+            if not batch:
+                break
+            for conversation in batch:
+                yield conversation
+    finally:
+        cursor.close()
+
+
+def conversation_json(conversation):
+    """A conversation as one JSON line"""
+    return json.dumps({
+        **conversation,
+        "_id": str(conversation["_id"]),
+        "timestamp": conversation["timestamp"].isoformat() if isinstance(conversation.get("timestamp"), datetime)
+        else conversation.get("timestamp"),
+    }, ensure_ascii=False)
+
+
+def _parse_legacy_timestamp(value):
+    # Old entries hold the server's local time without a zone
+    local = datetime.fromisoformat(value)
+    if local.tzinfo is None:
+        local = local.astimezone()
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _fallback_timestamp(conversation):
+    object_id = conversation["_id"]
+    if isinstance(object_id, ObjectId):
+        return object_id.generation_time.replace(tzinfo=None)
+    return datetime.utcnow()
+
+
+def migrate_conversation_timestamps(batch_size=1000):
+    """Give every conversation a UTC datetime timestamp; returns how many were converted"""
+    converted = 0
+    pending = []
+    for conversation in db.conversations.find({"timestamp": {"$not": {"$type": "date"}}}, {"timestamp": 1}):
+        try:
+            timestamp = _parse_legacy_timestamp(conversation["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            timestamp = _fallback_timestamp(conversation)
+            print(f"Timestamp không hợp lệ của conversation {conversation['_id']}: "
+                  f"{conversation.get('timestamp')!r}, dùng thời điểm tạo {timestamp.isoformat()}")
+        pending.append(UpdateOne({"_id": conversation["_id"]}, {"$set": {"timestamp": timestamp}}))
+        if len(pending) >= batch_size:
+            converted += db.conversations.bulk_write(pending, ordered=False).modified_count
+            pending = []
+    if pending:
+        converted += db.conversations.bulk_write(pending, ordered=False).modified_count
+    return converted
@@ -0,0 +1,41 @@
+"""
+Async access to MongoDB for the FastAPI handlers.
+
+pymongo is synchronous, so every call made from an ``async def`` endpoint goes
+through ``run_db``, which runs it on a dedicated thread pool of
+MONGO_EXECUTOR_WORKERS threads instead of blocking the event loop. The pool is
+separate from Starlette's default threadpool so slow queries cannot starve
+other offloaded work, and its size should stay at or below
+MONGO_MAX_POOL_SIZE connections.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from config import MONGO_EXECUTOR_WORKERS
+
+_executor = ThreadPoolExecutor(max_workers=MONGO_EXECUTOR_WORKERS, thread_name_prefix="mongo")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking pymongo call on the database executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def find_all(collection, *args, sort=None, skip=0, limit=0, **kwargs):
+    """Run a find and materialize the cursor on the database executor"""
+    def _query():
+        cursor = collection.find(*args, **kwargs)
+        if sort is not None:
+            cursor = cursor.sort(*sort) if isinstance(sort, tuple) else cursor.sort(sort)
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+    return await run_db(_query)
+
+
+def shutdown_db_executor():
+    _executor.shutdown(wait=False)
@@ -0,0 +1,498 @@
+"""
+Disk-backed vector store: FAISS vectors plus chunk text in SQLite.
+
+Chunk text and metadata live in ``faiss_index/docstore.sqlite``; each row's
+integer id is also the id of its vector in the FAISS index. A search only
+reads the rows of its top-k hits, and the FAISS file of a version is
+memory-mapped, so neither worker memory nor load time grows with the amount
+of text in the corpus. Nothing is unpickled.
+
+The SQLite file is shared by all index versions. Rows are only appended;
+deleted chunks are flagged and purged after DOCSTORE_PURGE_AFTER_SECONDS,
+so readers still holding an older snapshot can fetch them in the meantime.
+Indexes saved by LangChain (``index.pkl``) are converted on load.
+
+Searches can be restricted to chunks whose metadata matches a filter such as
+``{"file_id": [...], "filename": "a.pdf"}``. The matching ids are looked up in
+SQLite and handed to FAISS as an IDSelector, so other chunks are never
+scored; filters matching at most FILTER_EXACT_MAX chunks are searched exactly.
+
+The same database holds an FTS5 full-text index over the chunk text, kept in
+sync by triggers as chunks are added and purged, for BM25 keyword search.
+The unicode61 tokenizer folds case but keeps Vietnamese diacritics, and keeps
+hyphenated codes such as "NĐ-CP" or "ND-45" as single tokens. The index
+stores no positions and no copy of the text (detail=none, external content),
+so it stays small. Once the searched shard holds BM25_MIN_CHUNKS live
+chunks, query terms found in more than BM25_MAX_DOC_FRACTION of them are
+dropped: they barely affect the ranking but make a search visit most of the
+index.
+"""
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from ann_index import (
+    configure_search,
+    create_index,
+    index_ids,
+    read_index_meta,
+    reconstruct_vectors,
+    search_parameters,
+)
+
+DOCSTORE_FILE = "docstore.sqlite"
+DOCSTORE_PURGE_AFTER_SECONDS = float(os.getenv('DOCSTORE_PURGE_AFTER_SECONDS', '3600'))
+INDEX_MMAP = os.getenv('INDEX_MMAP', 'true').lower() == 'true'
+FILTER_EXACT_MAX = int(os.getenv('FILTER_EXACT_MAX', '4096'))
+BM25_MAX_DOC_FRACTION = float(os.getenv('BM25_MAX_DOC_FRACTION', '0.2'))
+BM25_MIN_CHUNKS = int(os.getenv('BM25_MIN_CHUNKS', '200'))
+# Seconds the number of live chunks of a search scope is reused
+_LIVE_COUNT_TTL = 30
+
+INDEX_FILE = "index.faiss"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+# Zero-copy mapping of flat codes needs a recent FAISS; older builds only map IVF lists
+_MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+_FILTER_KEY = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# Must split text the same way as the FTS5 tokenizer below
+_QUERY_TOKEN = re.compile(r"[\w-]+")
+MAX_QUERY_TOKENS = 32
+
+_reconstruct_lock = threading.Lock()
+
+
+class ChunkStore:
+    """SQLite table of chunk text and metadata keyed by FAISS id"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._live_counts = {}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "id INTEGER PRIMARY KEY, doc_id TEXT UNIQUE NOT NULL, file_id TEXT, "
+                "text TEXT NOT NULL, metadata TEXT NOT NULL, deleted_at REAL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(chunks)")]
+            if "shard" not in columns:
+                # Rows written before shards were recorded; see assign_shard()
+                conn.execute("ALTER TABLE chunks ADD COLUMN shard TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_file_id ON chunks (file_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_deleted_at ON chunks (deleted_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_shard ON chunks (shard)")
+            self._create_fts(conn)
+
+    def _create_fts(self, conn):
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+            "text, content='chunks', content_rowid='id', detail=none, "
+            "tokenize=\"unicode61 remove_diacritics 0 tokenchars '-_'\")"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN "
+            "INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text); END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN "
+            "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text); END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF text ON chunks BEGIN "
+            "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+            "INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text); END"
+        )
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts_vocab USING fts5vocab(chunks_fts, row)")
+        if not exists:
+            # Index chunks stored before full-text search was added
+            conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+
+    def _connect(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def add(self, texts, metadatas=None, doc_ids=None, shard=None):
+        """Insert chunks of an index shard and return their FAISS ids.
+
+        Chunks whose doc_id is already stored keep their existing row, which
+        makes converting the same legacy index twice harmless.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        doc_ids = doc_ids or [str(uuid.uuid4()) for _ in texts]
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunks (doc_id, file_id, shard, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (doc_id, (metadata or {}).get("file_id"), shard, text, json.dumps(metadata or {}))
+                    for doc_id, text, metadata in zip(doc_ids, texts, metadatas)
+                ]
+            )
+        return self.ids_for(doc_ids), doc_ids
+
+    def ids_for(self, doc_ids):
+        """FAISS ids of the given doc ids, in the same order; unknown ids are skipped"""
+        rows = {}
+        conn = self._connect()
+        for batch in _batches(list(doc_ids)):
+            placeholders = ",".join("?" * len(batch))
+            rows.update(conn.execute(
+                f"SELECT doc_id, id FROM chunks WHERE doc_id IN ({placeholders})", batch
+            ).fetchall())
+        return [rows[doc_id] for doc_id in doc_ids if doc_id in rows]
+
+    def locate(self, doc_ids):
+        """Map doc ids to (FAISS id, shard); unknown ids are left out"""
+        rows = {}
+        conn = self._connect()
+        for batch in _batches(list(doc_ids)):
+            placeholders = ",".join("?" * len(batch))
+            for doc_id, row_id, shard in conn.execute(
+                f"SELECT doc_id, id, shard FROM chunks WHERE doc_id IN ({placeholders})", batch
+            ):
+                rows[doc_id] = (row_id, shard)
+        return rows
+
+    def get(self, ids):
+        """Map FAISS ids to Documents; ids without a row are left out"""
+        rows = {}
+        conn = self._connect()
+        for batch in _batches([int(i) for i in ids]):
+            placeholders = ",".join("?" * len(batch))
+            for row_id, doc_id, text, metadata in conn.execute(
+                f"SELECT id, doc_id, text, metadata FROM chunks WHERE id IN ({placeholders})", batch
+            ):
+                rows[row_id] = Document(page_content=text, metadata=json.loads(metadata), id=doc_id)
+        return rows
+
+    def _where(self, filter=None, shard=None, table="chunks"):
+        """SQL conditions selecting live chunks of a shard whose metadata matches filter.
+
+        Filter values may be a scalar or a list of accepted values; file_id uses
+        its own indexed column, other keys are read from the metadata JSON.
+        Returns (sql, params), or None if the filter cannot match anything.
+        """
+        clauses = [f"{table}.deleted_at IS NULL"]
+        params = []
+        if shard is not None:
+            clauses.append(f"{table}.shard = ?")
+            params.append(shard)
+        for key, value in (filter or {}).items():
+            if not _FILTER_KEY.fullmatch(key):
+                raise ValueError(f"Invalid filter key: {key}")
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            if not values:
+                return None
+            if key == "file_id":
+                column = f"{table}.file_id"
+            else:
+                column = f"json_extract({table}.metadata, ?)"
+                params.append(f"$.{key}")
+            clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        return " AND ".join(clauses), params
+
+    def matching_ids(self, filter, shard=None):
+        """FAISS ids of live chunks of a shard whose metadata matches every key of filter"""
+        where = self._where(filter, shard)
+        if where is None:
+            return []
+        sql, params = where
+        return [row[0] for row in self._connect().execute(f"SELECT id FROM chunks WHERE {sql}", params)]
+
+    def keyword_search(self, text, k=4, filter=None, shard=None):
+        """BM25 search of the chunk text; returns (id, score) pairs, best (lowest) score first"""
+        tokens = list(dict.fromkeys(t.strip("-_").lower() for t in _QUERY_TOKEN.findall(text)))
+        where = self._where(filter, shard, table="c")
+        if where is None:
+            return []
+        sql, params = where
+        tokens = self._selective_terms([t for t in tokens if t][:MAX_QUERY_TOKENS], sql, params)
+        if not tokens:
+            return []
+        # Quoting every token keeps FTS5 query syntax out of user input
+        query = " OR ".join(f'"{t}"' for t in tokens)
+        rows = self._connect().execute(
+            f"SELECT c.id, bm25(chunks_fts) AS score FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid "
+            f"WHERE chunks_fts MATCH ? AND {sql} ORDER BY score LIMIT ?",
+            [query, *params, k]
+        )
+        return [(row_id, score) for row_id, score in rows]
+
+    def _live_count(self, sql, params):
+        """Number of live chunks matching the conditions, cached for _LIVE_COUNT_TTL seconds"""
+        key = (sql, tuple(params))
+        cached = self._live_counts.get(key)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < _LIVE_COUNT_TTL:
+            return cached[1]
+        count = self._connect().execute(f"SELECT count(*) FROM chunks c WHERE {sql}", params).fetchone()[0]
+        if len(self._live_counts) > 1000:
+            self._live_counts.clear()
+        self._live_counts[key] = (now, count)
+        return count
+
+    def _selective_terms(self, tokens, sql, params):
+        """Indexed tokens that occur in at most BM25_MAX_DOC_FRACTION of the live chunks matching sql"""
+        if not tokens:
+            return []
+        conn = self._connect()
+        doc_counts = dict(conn.execute(
+            f"SELECT term, doc FROM chunks_fts_vocab WHERE term IN ({','.join('?' * len(tokens))})", tokens
+        ))
+        tokens = [t for t in tokens if doc_counts.get(t, 0) > 0]
+        live = self._live_count(sql, params)
+        if live < BM25_MIN_CHUNKS:
+            # In a small corpus every term is cheap to search and most carry signal
+            return tokens
+        cutoff = int(BM25_MAX_DOC_FRACTION * live)
+        selective = []
+        for t in tokens:
+            count = doc_counts[t]
+            if count > cutoff:
+                # The vocabulary counts all shards and deleted rows: count this scope, stopping past the cutoff
+                count = conn.execute(
+                    f"SELECT count(*) FROM (SELECT 1 FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid "
+                    f"WHERE chunks_fts MATCH ? AND {sql} LIMIT ?)",
+                    [f'"{t}"', *params, cutoff + 1]
+                ).fetchone()[0]
+            if count <= cutoff:
+                selective.append(t)
+        return selective
+
+    def has_unassigned(self):
+        return self._connect().execute("SELECT 1 FROM chunks WHERE shard IS NULL LIMIT 1").fetchone() is not None
+
+    def assign_shard(self, ids, shard):
+        """Record the shard of rows stored before shards were recorded"""
+        conn = self._connect()
+        with conn:
+            for batch in _batches([int(i) for i in ids]):
+                conn.execute(
+                    f"UPDATE chunks SET shard = ? WHERE shard IS NULL AND id IN ({','.join('?' * len(batch))})",
+                    [shard, *batch]
+                )
+
+    def mark_deleted(self, ids):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany("UPDATE chunks SET deleted_at = ? WHERE id = ?", [(now, int(i)) for i in ids])
+
+    def purge_deleted(self, older_than=DOCSTORE_PURGE_AFTER_SECONDS):
+        """Drop rows flagged as deleted long enough ago that no snapshot can still need them"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute("DELETE FROM chunks WHERE deleted_at < ?", (time.time() - older_than,))
+        return cursor.rowcount
+
+
+def _batches(items, size=500):
+    # SQLite limits the number of host parameters per statement
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class DiskVectorStore:
+    """FAISS index whose search results are resolved against a ChunkStore"""
+
+    def __init__(self, index, meta, chunks, shard):
+        self.index = index
+        self.meta = meta
+        self.chunks = chunks
+        self.shard = shard
+        self._sorted_ids = None
+        self._ids_lock = threading.Lock()
+
+    @classmethod
+    def build(cls, chunks, shard, ids, vectors, dim=None, index_type=None):
+        """Create an index of the configured type holding vectors under the given ids"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        dim = vectors.shape[1] if len(vectors) else dim
+        index, meta = create_index(vectors, dim, index_type)
+        if len(vectors):
+            index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+        return cls(index, meta, chunks, shard)
+
+    @classmethod
+    def load(cls, path, chunks, shard, mmap=INDEX_MMAP, embeddings=None):
+        """Load a saved version; mmap=False gives a private copy that can be modified"""
+        if os.path.exists(os.path.join(path, LEGACY_DOCSTORE_FILE)):
+            return cls.from_legacy(path, chunks, shard, embeddings)
+        index_path = os.path.join(path, INDEX_FILE)
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(index_path, _MMAP_FLAGS)
+            except RuntimeError as e:
+                print(f"Không thể mmap vector index, đọc toàn bộ vào bộ nhớ: {str(e)}")
+        if index is None:
+            index = faiss.read_index(index_path)
+        meta = read_index_meta(path)
+        configure_search(index, meta)
+        return cls(index, meta, chunks, shard)
+
+    @classmethod
+    def from_legacy(cls, path, chunks, shard, embeddings=None):
+        """Convert a LangChain FAISS.save_local folder (index.faiss + pickled docstore).
+
+        The pickle was written by this application, so loading it once here is
+        safe; the converted version no longer contains one.
+        """
+        with open(os.path.join(path, LEGACY_DOCSTORE_FILE), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        legacy_index = faiss.read_index(os.path.join(path, INDEX_FILE))
+        legacy_meta = read_index_meta(path)
+
+        positions = sorted(index_to_docstore_id)
+        doc_ids = [index_to_docstore_id[p] for p in positions]
+        docs = [docstore.search(doc_id) for doc_id in doc_ids]
+        ids, _ = chunks.add([d.page_content for d in docs], [d.metadata for d in docs], doc_ids, shard)
+
+        vectors = reconstruct_vectors(legacy_index, legacy_meta, positions)
+        if vectors is None:
+            if embeddings is None:
+                raise ValueError("Cần embeddings để chuyển đổi index IVF-PQ cũ")
+            vectors = embeddings.embed_documents([d.page_content for d in docs])
+        print(f"Đã chuyển {len(ids)} chunks từ index.pkl sang {DOCSTORE_FILE}")
+        return cls.build(
+            chunks, shard, ids, vectors, dim=legacy_index.d, index_type=legacy_meta.get("index_type", "flat")
+        )
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def ids(self):
+        return index_ids(self.index)
+
+    def contains(self, ids):
+        """Mask of the ids that are part of this index version"""
+        with self._ids_lock:
+            if self._sorted_ids is None:
+                self._sorted_ids = np.sort(self.ids())
+            sorted_ids = self._sorted_ids
+        ids = np.asarray(ids, dtype="int64")
+        if not len(sorted_ids):
+            return np.zeros(len(ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return sorted_ids[positions] == ids
+
+    def vectors(self, ids):
+        """Stored vectors for the given ids, or None for lossy (IVF-PQ) indexes"""
+        # The first call on an IVF index builds its id lookup table, which is not thread-safe
+        with _reconstruct_lock:
+            return reconstruct_vectors(self.index, self.meta, ids)
+
+    def add_embeddings(self, texts, vectors, metadatas=None, doc_ids=None):
+        """Store chunks and their vectors; returns the new doc ids"""
+        ids, doc_ids = self.chunks.add(texts, metadatas, doc_ids, shard=self.shard)
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), np.asarray(ids, dtype="int64"))
+        self._sorted_ids = None
+        return doc_ids
+
+    def remove(self, ids):
+        self.index.remove_ids(np.asarray(ids, dtype="int64"))
+        self._sorted_ids = None
+
+    def _filtered_search(self, queries, k, allowed):
+        allowed = np.asarray(allowed, dtype="int64")
+        small = len(allowed) <= FILTER_EXACT_MAX
+        if small and self.meta.get("index_type", "flat") == "hnsw":
+            # A graph walk finds few neighbours that pass a selective filter; score them all instead
+            return self._exact_search(queries, k, allowed)
+        selector = faiss.IDSelectorBatch(allowed)
+        params = search_parameters(self.index, self.meta, selector, exhaustive=small)
+        return self.index.search(queries, k, params=params)
+
+    def _exact_search(self, queries, k, allowed):
+        ids, vectors = [], []
+        for i in allowed:
+            try:
+                vectors.append(self.index.reconstruct(int(i)))
+            except RuntimeError:
+                # Row written by an ingest that is not part of this version
+                continue
+            ids.append(int(i))
+        scores = np.full((len(queries), k), np.inf, dtype="float32")
+        found = np.full((len(queries), k), -1, dtype="int64")
+        if ids:
+            vectors = np.vstack(vectors)
+            ids = np.asarray(ids)
+            for row, query in enumerate(queries):
+                distances = ((vectors - query) ** 2).sum(axis=1)
+                order = np.argsort(distances)[:k]
+                scores[row, :len(order)] = distances[order]
+                found[row, :len(order)] = ids[order]
+        return scores, found
+
+    def similarity_search_with_score_by_vectors(self, embeddings, k=4, filter=None):
+        """Closest chunks for each query vector, searched in one FAISS call.
+
+        Returns one list of (Document, L2 distance) per query, optionally
+        restricted by a metadata filter.
+        """
+        queries = np.asarray(embeddings, dtype="float32").reshape(-1, self.index.d)
+        if filter:
+            allowed = self.chunks.matching_ids(filter, self.shard)
+            if not allowed:
+                return [[] for _ in queries]
+            scores, ids = self._filtered_search(queries, k, allowed)
+        else:
+            scores, ids = self.index.search(queries, k)
+        hits = [
+            [(int(i), float(s)) for i, s in zip(row_ids, row_scores) if i != -1]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+        docs = self.chunks.get({i for row in hits for i, _ in row})
+        return [[(docs[i], score) for i, score in row if i in docs] for row in hits]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        """Closest chunks as (Document, L2 distance), optionally restricted by a metadata filter"""
+        return self.similarity_search_with_score_by_vectors([embedding], k, filter)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def keyword_search_with_score(self, text, k=4, filter=None):
+        """Chunks of this shard ranked by BM25 as (Document, score), lower is better"""
+        # The docstore also holds rows of ingests not committed to this version yet
+        hits = self.chunks.keyword_search(text, 2 * k, filter, self.shard)
+        if hits:
+            hits = [hit for hit, present in zip(hits, self.contains([i for i, _ in hits])) if present][:k]
+        docs = self.chunks.get([i for i, _ in hits])
+        return [(docs[i], score) for i, score in hits if i in docs]
+
+    def save_local(self, path):
+        os.makedirs(path, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(path, INDEX_FILE))
+
+
+_chunk_stores = {}
+_chunk_stores_lock = threading.Lock()
+
+
+def get_chunk_store(index_path):
+    """Return the process-wide ChunkStore of an index folder"""
+    with _chunk_stores_lock:
+        if index_path not in _chunk_stores:
+            os.makedirs(index_path, exist_ok=True)
+            _chunk_stores[index_path] = ChunkStore(os.path.join(index_path, DOCSTORE_FILE))
+        return _chunk_stores[index_path]
@@ -0,0 +1,156 @@
+"""
+Persistent embedding cache keyed by SHA-256 of (model name, chunk text).
+
+Wraps any LangChain ``Embeddings`` object: chunks embedded before are served
+from the cache and only the misses are sent to the embedder, in batches of at
+most ``EMBEDDING_BATCH_SIZE`` texts. Vectors are stored in MongoDB
+(``embedding_cache`` collection) or in a local SQLite file.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from embeddings import embed_queries
+from metrics import EMBEDDING_CACHE_LOOKUPS
+
+EMBEDDING_CACHE_BACKEND = os.getenv('EMBEDDING_CACHE_BACKEND', 'mongo')  # mongo | local | none
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite')
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '100'))
+
+
+def cache_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class MongoEmbeddingStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 1000):
+            for doc in self.collection.find({"_id": {"$in": keys[i:i + 1000]}}, {"vector": 1}):
+                found[doc["_id"]] = doc["vector"]
+        return found
+
+    def put_many(self, vectors, model_name):
+        from pymongo.errors import BulkWriteError
+
+        docs = [{"_id": key, "model": model_name, "vector": list(vector)} for key, vector in vectors.items()]
+        if not docs:
+            return
+        try:
+            self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError:
+            # Another worker cached some of the same chunks concurrently
+            pass
+
+
+class LocalEmbeddingStore:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, vectors, model_name):
+        rows = [(key, model_name, array("f", vector).tobytes()) for key, vector in vectors.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, embeddings, model_name, store, batch_size=EMBEDDING_BATCH_SIZE):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate, 4)}
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_name, text) for text in texts]
+        vectors = self.store.get_many(set(keys))
+
+        # Deduplicate misses so repeated chunks in one call are embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        missing_keys = list(missing)
+
+        for i in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[i:i + self.batch_size]
+            batch_vectors = self.embeddings.embed_documents([missing[k] for k in batch_keys])
+            new_vectors = dict(zip(batch_keys, batch_vectors))
+            self.store.put_many(new_vectors, self.model_name)
+            vectors.update(new_vectors)
+
+        with self._stats_lock:
+            self.misses += len(missing_keys)
+            self.hits += len(keys) - len(missing_keys)
+        EMBEDDING_CACHE_LOOKUPS.inc(len(keys) - len(missing_keys), result="hit")
+        EMBEDDING_CACHE_LOOKUPS.inc(len(missing_keys), result="miss")
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts):
+        # Questions are not cached, like embed_query
+        return embed_queries(self.embeddings, texts)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store():
+    """Return the configured cache store, or None when caching is disabled"""
+    global _store
+    if EMBEDDING_CACHE_BACKEND == "none":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if EMBEDDING_CACHE_BACKEND == "local":
+                    _store = LocalEmbeddingStore(EMBEDDING_CACHE_PATH)
+                elif EMBEDDING_CACHE_BACKEND == "mongo":
+                    from config import db
+                    _store = MongoEmbeddingStore(db["embedding_cache"])
+                else:
+                    raise ValueError(f"Unknown EMBEDDING_CACHE_BACKEND: {EMBEDDING_CACHE_BACKEND}")
+    return _store
@@ -0,0 +1,134 @@
+"""
+Embedding backends selected by the EMBEDDING_BACKEND setting.
+
+- ``google``: GoogleGenerativeAIEmbeddings (models/embedding-001), the default
+- ``sentence-transformers``: local model on CPU threads, batched
+- ``fake``: deterministic hashing embedder for tests and offline benchmarks
+
+Additional backends can be added with ``register_embedding_backend``.
+"""
+import hashlib
+import math
+import os
+import re
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'google')
+GOOGLE_EMBEDDING_MODEL = os.getenv('GOOGLE_EMBEDDING_MODEL', 'models/embedding-001')
+LOCAL_EMBEDDING_MODEL = os.getenv(
+    'LOCAL_EMBEDDING_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+)
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv('LOCAL_EMBEDDING_BATCH_SIZE', '32'))
+LOCAL_EMBEDDING_THREADS = int(os.getenv('LOCAL_EMBEDDING_THREADS', str(os.cpu_count() or 1)))
+FAKE_EMBEDDING_DIM = int(os.getenv('FAKE_EMBEDDING_DIM', '384'))
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """Local sentence-transformers model; no network round-trip per chunk"""
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, batch_size=LOCAL_EMBEDDING_BATCH_SIZE,
+                 num_threads=LOCAL_EMBEDDING_THREADS):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic bag-of-words hashing embedder.
+
+    Texts sharing words get similar vectors, so retrieval still behaves
+    sensibly in tests and benchmarks without any model or network access.
+    """
+
+    def __init__(self, dim=FAKE_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm == 0:
+            # Empty text still needs a valid unit vector
+            vector[0] = 1.0
+            return vector
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+def _google_backend(api_key=None):
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    class GoogleEmbeddings(GoogleGenerativeAIEmbeddings):
+        def embed_queries(self, texts):
+            # Batched like documents, but embedded for retrieval as queries
+            return self.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+
+    embeddings = GoogleEmbeddings(model=GOOGLE_EMBEDDING_MODEL, google_api_key=api_key)
+    return embeddings, f"google:{GOOGLE_EMBEDDING_MODEL}"
+
+
+def _sentence_transformers_backend(api_key=None):
+    return SentenceTransformerEmbeddings(), f"sentence-transformers:{LOCAL_EMBEDDING_MODEL}"
+
+
+def _fake_backend(api_key=None):
+    return FakeEmbeddings(), f"fake:{FAKE_EMBEDDING_DIM}"
+
+
+EMBEDDING_BACKENDS = {
+    "google": _google_backend,
+    "sentence-transformers": _sentence_transformers_backend,
+    "fake": _fake_backend,
+}
+
+
+def register_embedding_backend(name, factory):
+    """Register a factory taking api_key and returning (embeddings, model_id)"""
+    EMBEDDING_BACKENDS[name] = factory
+
+
+def embed_queries(embeddings, texts):
+    """Embed several questions, in one batched call if the backend has embed_queries"""
+    batch = getattr(embeddings, "embed_queries", None)
+    if batch is not None:
+        return batch(list(texts))
+    return [embeddings.embed_query(text) for text in texts]
+
+
+def create_embeddings(backend=None, api_key=None):
+    """Instantiate a backend. Returns (embeddings, model_id); model_id keys the embedding cache."""
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+    return EMBEDDING_BACKENDS[backend](api_key)
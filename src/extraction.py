@@ -0,0 +1,300 @@
+"""
+PDF text extraction in a pool of worker processes.
+
+PyPDF2 and OCR are CPU-bound, so they run outside the API process: one task
+per file, or per range of PDF_PAGES_PER_TASK pages for large files. Pages
+without a text layer are then rasterized one at a time at OCR_DPI and OCRed
+in parallel, one task per page. Every task is bounded by PDF_EXTRACT_TIMEOUT
+so a pathological PDF cannot hold a worker forever.
+
+A file split into several tasks is written once to a temporary file whose
+path is sent to the workers, rather than pickling the whole PDF into every
+task; the file is removed when extraction ends.
+
+This module must stay importable without config.py: worker processes import
+it and must not open their own MongoDB connections.
+"""
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes
+import pytesseract
+
+from metrics import PAGES_EXTRACTED, stage
+from ocr_cache import content_hash, get_ocr_cache
+
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+PDF_EXTRACT_TIMEOUT = float(os.getenv('PDF_EXTRACT_TIMEOUT', '120'))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '50'))
+OCR_DPI = int(os.getenv('OCR_DPI', '200'))
+# Use Vietnamese and English language packs
+OCR_LANG = os.getenv('OCR_LANG', 'vie+eng')
+
+# Extra time the parent waits after the worker-side limit before giving up
+_TIMEOUT_GRACE = 5
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+@contextmanager
+def _time_limit(seconds):
+    """Raise ExtractionTimeout inside the worker once seconds have elapsed"""
+    if not seconds or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _handler(signum, frame):
+        raise ExtractionTimeout(f"extraction exceeded {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, _handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _extract_page_range(source, start, end, time_limit):
+    """Worker: text layer of pages [start, end) of a PDF given as bytes or a file path"""
+    with _time_limit(time_limit):
+        pdf_reader = PdfReader(source if isinstance(source, str) else BytesIO(source))
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _ocr_page(source, page_number, dpi, lang, time_limit):
+    """Worker: rasterize a single page (1-based) of a PDF given as bytes or a file path and OCR it"""
+    with _time_limit(time_limit):
+        convert = convert_from_path if isinstance(source, str) else convert_from_bytes
+        images = convert(source, dpi=dpi, first_page=page_number, last_page=page_number)
+        if not images:
+            return ""
+        return pytesseract.image_to_string(images[0], lang=lang)
+
+
+def get_extraction_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn avoids forking a process that holds MongoDB and uvicorn threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=max(PDF_EXTRACT_WORKERS, 1),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def shutdown_extraction_pool():
+    """Drop the pool; also used to replace a pool whose worker crashed (e.g. OOM-killed)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _run(fn, *args):
+    """Run fn in the pool, or inline when PDF_EXTRACT_WORKERS is 0"""
+    if PDF_EXTRACT_WORKERS <= 0:
+        return _InlineResult(fn, *args)
+    try:
+        return get_extraction_pool().submit(fn, *args)
+    except BrokenProcessPool:
+        shutdown_extraction_pool()
+        return get_extraction_pool().submit(fn, *args)
+
+
+class _InlineResult:
+    def __init__(self, fn, *args):
+        self._fn = fn
+        self._args = args
+
+    def result(self, timeout=None):
+        return self._fn(*self._args)
+
+
+def _wait(future, deadline):
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except BrokenProcessPool:
+        shutdown_extraction_pool()
+        raise
+
+
+def _task_source(pdf_bytes, temp_files):
+    """Path of a temporary copy of the PDF for worker tasks, or the bytes themselves when run inline"""
+    if PDF_EXTRACT_WORKERS <= 0:
+        return pdf_bytes
+    with tempfile.NamedTemporaryFile(prefix="pdf-extract-", suffix=".pdf", delete=False) as f:
+        f.write(pdf_bytes)
+    temp_files.append(f.name)
+    return f.name
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _count_pages(pdf_bytes, time_limit):
+    """Worker: (number of pages, whether PyPDF2 can read the text layer)"""
+    with _time_limit(time_limit):
+        try:
+            return len(PdfReader(BytesIO(pdf_bytes)).pages), True
+        except ExtractionTimeout:
+            raise
+        except Exception:
+            # PyPDF2 cannot parse it; poppler may still be able to rasterize it
+            return int(pdfinfo_from_bytes(pdf_bytes)["Pages"]), False
+
+
+def _deadline(num_tasks, timeout):
+    # Tasks queue behind each other when there are more tasks than workers,
+    # so the parent-side deadline scales with the number of rounds needed
+    rounds = -(-num_tasks // max(PDF_EXTRACT_WORKERS, 1))
+    return time.monotonic() + timeout * max(rounds, 1) + _TIMEOUT_GRACE
+
+
+def extract_pages(pdfs, timeout=PDF_EXTRACT_TIMEOUT, dpi=OCR_DPI, lang=OCR_LANG):
+    """Extract the text of every page of several PDFs in parallel.
+
+    Pages with a text layer use it directly; only pages without one are OCRed,
+    and pages OCRed before with the same DPI and languages come from the cache.
+
+    Args:
+        pdfs: list of (pdf_bytes, filename)
+        timeout: limit in seconds for each worker task
+        dpi: rasterization resolution for OCR pages
+        lang: tesseract language packs
+
+    Returns:
+        one list of page texts per file, in page order ([] for files that failed)
+    """
+    temp_files = []
+    try:
+        with stage("pdf_text"):
+            results, ocr_jobs, ocr_cached = _extract_text_layers(pdfs, timeout, dpi, lang, temp_files)
+
+        if ocr_jobs:
+            with stage("ocr"):
+                _wait_for_ocr(pdfs, results, ocr_jobs, timeout)
+    finally:
+        # Tasks abandoned after a timeout keep an open file working; their results are ignored anyway
+        _remove_files(temp_files)
+    PAGES_EXTRACTED.inc(sum(len(pages) for pages in results) - len(ocr_jobs) - ocr_cached, method="text")
+    PAGES_EXTRACTED.inc(len(ocr_jobs), method="ocr")
+    PAGES_EXTRACTED.inc(ocr_cached, method="ocr_cache")
+    return results
+
+
+def _extract_text_layers(pdfs, timeout, dpi, lang, temp_files):
+    """Read the text layers and queue OCR for pages without one.
+
+    Temporary copies of the PDFs made for the tasks are added to temp_files.
+    Returns (results, ocr_jobs, number of pages served from the OCR cache)
+    """
+    ocr_cache = get_ocr_cache()
+
+    # Parsing the page tree can hang on a pathological PDF, so it is a bounded task too
+    counts = [_run(_count_pages, pdf_bytes, timeout) for pdf_bytes, _ in pdfs]
+    count_deadline = _deadline(len(counts), timeout)
+
+    # Submit every text-layer task up front so files are processed concurrently
+    jobs = []
+    for (pdf_bytes, filename), count in zip(pdfs, counts):
+        try:
+            num_pages, has_text_layer = _wait(count, count_deadline)
+            futures = []
+            source = None
+            if has_text_layer:
+                starts = range(0, num_pages, PDF_PAGES_PER_TASK)
+                source = _task_source(pdf_bytes, temp_files) if len(starts) > 1 else pdf_bytes
+                futures = [
+                    _run(_extract_page_range, source, start, min(start + PDF_PAGES_PER_TASK, num_pages), timeout)
+                    for start in starts
+                ]
+            jobs.append((num_pages, futures, source, None))
+        except Exception as e:
+            jobs.append((0, [], None, e))
+
+    deadline = _deadline(sum(len(futures) for _, futures, _, _ in jobs), timeout)
+    results = []
+    ocr_jobs = []
+    ocr_cached = 0
+    for (pdf_bytes, filename), (num_pages, futures, source, error) in zip(pdfs, jobs):
+        if error is not None:
+            print(f"Lỗi khi xử lý file {filename}: {str(error)}")
+            results.append([])
+            continue
+
+        page_texts = [""] * num_pages
+        try:
+            texts = []
+            for future in futures:
+                texts.extend(_wait(future, deadline))
+            page_texts[:len(texts)] = texts
+        except (ExtractionTimeout, FutureTimeoutError) as e:
+            print(f"Hết thời gian trích xuất file {filename}: {str(e)}")
+            results.append([])
+            continue
+        except Exception as e:
+            print(f"Lỗi khi đọc file {filename} bằng PyPDF2, đang thử dùng OCR: {str(e)}")
+
+        # Only pages without a text layer are rasterized and OCRed
+        missing = [i for i, text in enumerate(page_texts) if not text.strip()]
+        if missing:
+            print(f"Phát hiện {len(missing)}/{num_pages} trang scan, đang sử dụng OCR cho: {filename}")
+        file_hash = content_hash(pdf_bytes) if ocr_cache is not None and missing else None
+        for i in missing:
+            cache_key = None
+            if file_hash is not None:
+                cache_key = ocr_cache.key(file_hash, i + 1, dpi, lang)
+                cached = ocr_cache.get(cache_key)
+                if cached is not None:
+                    page_texts[i] = cached
+                    ocr_cached += 1
+                    continue
+            if not isinstance(source, str):
+                # Every OCR task reads the same copy instead of receiving the whole PDF
+                source = _task_source(pdf_bytes, temp_files)
+            ocr_jobs.append((len(results), i, cache_key, _run(_ocr_page, source, i + 1, dpi, lang, timeout)))
+        results.append(page_texts)
+    return results, ocr_jobs, ocr_cached
+
+
+def _wait_for_ocr(pdfs, results, ocr_jobs, timeout):
+    ocr_cache = get_ocr_cache()
+    ocr_deadline = _deadline(len(ocr_jobs), timeout)
+    for file_index, page_index, cache_key, future in ocr_jobs:
+        try:
+            results[file_index][page_index] = _wait(future, ocr_deadline)
+            if cache_key is not None:
+                ocr_cache.put(cache_key, results[file_index][page_index])
+        except Exception as e:
+            print(f"Lỗi khi xử lý OCR trang {page_index + 1} của file {pdfs[file_index][1]}: {str(e)}")
+
+
+def extract_texts(pdfs, timeout=PDF_EXTRACT_TIMEOUT):
+    """Like extract_pages, but returns one text per file ("" for files that failed)"""
+    return [
+        "\n\n".join(page.strip() for page in pages if page.strip())
+        for pages in extract_pages(pdfs, timeout)
+    ]
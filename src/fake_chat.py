@@ -0,0 +1,37 @@
+"""
+Chat model stand-in for offline benchmarks and tests (MODEL_NAME=Fake).
+
+Waits FAKE_LLM_LATENCY_MS, like a model call would, then answers with the
+start of the context it was given. No API key, network or quota is needed.
+"""
+import asyncio
+import os
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FAKE_LLM_LATENCY_MS = float(os.getenv('FAKE_LLM_LATENCY_MS', '300'))
+FAKE_LLM_ANSWER_CHARS = 200
+
+
+class FakeChatModel(BaseChatModel):
+    latency_ms: float = FAKE_LLM_LATENCY_MS
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def _result(self, messages):
+        prompt = messages[-1].content if messages else ""
+        context = prompt.split("Context:", 1)[-1].split("Question:", 1)[0].strip()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=context[:FAKE_LLM_ANSWER_CHARS]))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._result(messages)
@@ -0,0 +1,122 @@
+"""
+Recall-versus-latency report for the FAISS index types.
+
+Builds every candidate configuration from the vectors of the current index
+and compares it with an exact flat search:
+
+    python index_report.py --queries 200 --k 4 --json index_report.json
+
+Queries are stored vectors with a little noise added, so no embedding API
+calls are needed unless the current index is lossy (IVF-PQ), in which case
+the chunks are embedded again through the embedding cache.
+"""
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import create_index, configure_search
+from app import get_embeddings, get_vector_store_holder
+from shards import SHARED_SHARD
+
+CANDIDATES = [
+    ("flat", {}),
+    ("ivf_flat", {"nlist": 64, "nprobe": 4}),
+    ("ivf_flat", {"nlist": 64, "nprobe": 16}),
+    ("ivf_flat", {"nlist": 256, "nprobe": 16}),
+    ("ivf_flat", {"nlist": 256, "nprobe": 32}),
+    ("ivf_pq", {"nlist": 256, "nprobe": 16, "pq_m": 16, "pq_nbits": 8}),
+    ("ivf_pq", {"nlist": 256, "nprobe": 32, "pq_m": 32, "pq_nbits": 8}),
+    ("hnsw", {"hnsw_m": 16, "ef_search": 32}),
+    ("hnsw", {"hnsw_m": 32, "ef_search": 64}),
+    ("hnsw", {"hnsw_m": 32, "ef_search": 128}),
+]
+
+
+def load_corpus_vectors(model_name, api_key, shard):
+    holder = get_vector_store_holder(model_name, api_key, shard)
+    snapshot = holder.get()
+    store = holder.load_version(snapshot.version)
+    ids = sorted(int(i) for i in store.ids())
+    vectors = store.vectors(ids)
+    if vectors is None:
+        docs = store.chunks.get(ids)
+        texts = [docs[i].page_content for i in ids if i in docs]
+        vectors = np.asarray(get_embeddings(model_name, api_key).embed_documents(texts), dtype="float32")
+    return np.ascontiguousarray(vectors, dtype="float32"), store.meta
+
+
+def make_queries(vectors, n_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    noise = rng.normal(scale=0.05 * float(np.std(vectors)), size=sample.shape).astype("float32")
+    return np.ascontiguousarray(sample + noise, dtype="float32")
+
+
+def evaluate(vectors, queries, truth, index_type, params, k):
+    started = time.perf_counter()
+    index, meta = create_index(vectors, vectors.shape[1], index_type, params)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype="int64"))
+    configure_search(index, meta, params)
+    build_s = time.perf_counter() - started
+
+    latencies = []
+    found = []
+    for query in queries:
+        t0 = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append(ids[0])
+
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    search_params = {"ivf_flat": "nprobe", "ivf_pq": "nprobe", "hnsw": "ef_search"}.get(meta["index_type"])
+    built_params = dict(meta["params"])
+    if search_params in params:
+        built_params[search_params] = params[search_params]
+    return {
+        "requested_type": index_type,
+        "index_type": meta["index_type"],
+        "params": built_params,
+        "build_s": round(build_s, 3),
+        "size_mb": round(faiss.serialize_index(index).nbytes / 1024 / 1024, 2),
+        "recall_at_k": round(float(recall), 4),
+        "latency_ms_mean": round(float(np.mean(latencies)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--shard", default=SHARED_SHARD, help="index shard to evaluate")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    model_name = os.getenv('MODEL_NAME', 'Google AI')
+    vectors, current_meta = load_corpus_vectors(model_name, os.getenv('API_KEY'), args.shard)
+    queries = make_queries(vectors, args.queries)
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, truth = baseline.search(queries, args.k)
+
+    results = [evaluate(vectors, queries, truth, t, p, args.k) for t, p in CANDIDATES]
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, current index: {current_meta.get('index_type')}")
+    print(f"{'requested':<10} {'built':<10} {'params':<44} {'recall@k':>8} {'mean ms':>8} {'p95 ms':>8} {'MB':>8}")
+    for r in results:
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items())
+        print(f"{r['requested_type']:<10} {r['index_type']:<10} {params:<44} {r['recall_at_k']:>8} "
+              f"{r['latency_ms_mean']:>8} {r['latency_ms_p95']:>8} {r['size_mb']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"vectors": len(vectors), "k": args.k, "current": current_meta, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
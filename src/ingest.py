@@ -0,0 +1,62 @@
+"""
+Ingestion pipeline: turns a single uploaded PDF into chunks in the vector index.
+
+Only the new file is extracted, chunked and embedded; its vectors are appended
+to the existing FAISS index so /chat never has to rebuild it.
+"""
+from app import extract_pages_from_bytes, get_embeddings, add_to_vector_store
+from chunking import chunk_pages
+from embedding_cache import EMBEDDING_BATCH_SIZE
+from metrics import CHUNKS_EMBEDDED, stage
+from shards import SHARED_SHARD
+from storage import read_file
+
+
+class UnreadablePDFError(ValueError):
+    """The PDF has no text, even after OCR; retrying will not change that"""
+
+
+def ingest_pdf(pdf_bytes, filename, file_id, user_id, model_name, api_key=None, progress=None, shard=SHARED_SHARD):
+    """Extract, chunk, embed and index one PDF. Returns the ids of the indexed chunks.
+
+    Args:
+        progress: optional callable(stage, fraction) called as the pipeline advances;
+            it may raise to abort, and is not called once the chunks are committed
+        shard: index shard the chunks are added to
+    """
+    def report(stage, fraction):
+        if progress is not None:
+            progress(stage, fraction)
+
+    report("extract", 0.0)
+    pages = extract_pages_from_bytes(pdf_bytes, filename)
+    if not any(page.strip() for page in pages):
+        raise UnreadablePDFError(f"Không thể đọc nội dung từ file PDF: {filename}")
+
+    report("chunk", 0.3)
+    # Each chunk keeps the pages it came from so answers can cite them
+    with stage("chunk"):
+        chunks, page_metadatas = chunk_pages(pages)
+    metadatas = [
+        {"file_id": file_id, "filename": filename, "user_id": user_id, "chunk": i, **pages_of_chunk}
+        for i, pages_of_chunk in enumerate(page_metadatas)
+    ]
+
+    report("embed", 0.4)
+    embeddings = get_embeddings(model_name, api_key)
+    vectors = []
+    for i in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
+        with stage("embed_chunks"):
+            vectors.extend(embeddings.embed_documents(chunks[i:i + EMBEDDING_BATCH_SIZE]))
+        report("embed", 0.4 + 0.5 * len(vectors) / len(chunks))
+    CHUNKS_EMBEDDED.inc(len(chunks))
+
+    report("index", 0.9)
+    with stage("index_write"):
+        ids = add_to_vector_store(chunks, model_name, api_key, metadatas=metadatas, vectors=vectors, shard=shard)
+    return ids
+
+
+def ingest_file(file_id, filename, user_id, model_name, api_key=None, progress=None, shard=SHARED_SHARD):
+    """Ingest a PDF that is already stored in GridFS"""
+    return ingest_pdf(read_file(file_id), filename, file_id, user_id, model_name, api_key, progress, shard)
@@ -0,0 +1,274 @@
+"""
+Background ingestion jobs persisted in MongoDB.
+
+POST /upload-pdfs/ only stores the PDF and enqueues a job in the
+``ingest_jobs`` collection. INGEST_CONCURRENCY worker tasks per process claim
+queued jobs atomically and run extract -> chunk -> embed -> index, recording
+the stage and progress on the job document. A running job holds a lease that
+is renewed by a heartbeat while the job runs; if the process dies, the lease
+expires and another worker picks the job up again, so jobs survive restarts.
+
+Each claim gets its own lease owner token. A worker that finds the job
+cancelled (its file was deleted) or claimed by someone else stops at the next
+progress update, and chunks it already committed are removed again instead
+of being recorded, so a file is never left indexed twice or after deletion.
+Failed jobs are queued again up to INGEST_MAX_ATTEMPTS times, except for PDFs
+with no readable text, which fail at once.
+"""
+import asyncio
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+
+from app import delete_from_vector_store
+from config import db
+from database import run_db
+from ingest import UnreadablePDFError, ingest_file
+from shards import SHARED_SHARD, shard_query
+
+INGEST_CONCURRENCY = int(os.getenv('INGEST_CONCURRENCY', '2'))
+INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', '2'))
+INGEST_JOB_LEASE_SECONDS = int(os.getenv('INGEST_JOB_LEASE_SECONDS', '600'))
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', '3'))
+
+ingest_jobs = db['ingest_jobs']
+ingest_jobs.create_index([("status", 1), ("created_at", 1)])
+
+_workers = []
+
+
+class IngestJobCancelled(Exception):
+    """The job was cancelled or its lease passed to another worker"""
+
+
+def enqueue_ingest_job(file_record_id, file_id, filename, user_id, shard=SHARED_SHARD):
+    """Queue a stored PDF for ingestion into an index shard and return the job id"""
+    now = datetime.utcnow()
+    result = ingest_jobs.insert_one({
+        "file_record_id": file_record_id,
+        "file_id": file_id,
+        "filename": filename,
+        "user_id": user_id,
+        "shard": shard,
+        "status": "queued",
+        "stage": "queued",
+        "progress": 0.0,
+        "error": None,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+    })
+    return str(result.inserted_id)
+
+
+def cancel_ingest_jobs(job_id):
+    """Cancel a job that has not finished; a running job stops at its next progress update"""
+    try:
+        job_id = ObjectId(job_id)
+    except Exception:
+        return
+    ingest_jobs.update_one(
+        {"_id": job_id, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"status": "cancelled", "stage": "cancelled", "updated_at": datetime.utcnow()}}
+    )
+
+
+def active_ingest_job(job_ids):
+    """Id of one of the given jobs that is still queued or running, or None"""
+    object_ids = []
+    for job_id in job_ids:
+        try:
+            object_ids.append(ObjectId(job_id))
+        except Exception:
+            continue
+    job = ingest_jobs.find_one({"_id": {"$in": object_ids}, "status": {"$in": ["queued", "running"]}}, {"_id": 1})
+    return str(job["_id"]) if job is not None else None
+
+
+def get_ingest_job(job_id):
+    try:
+        job = ingest_jobs.find_one({"_id": ObjectId(job_id)})
+    except Exception:
+        return None
+    if job is not None:
+        job["id"] = str(job.pop("_id"))
+    return job
+
+
+def claim_next_job():
+    """Atomically take the oldest queued job, or a running one whose lease expired"""
+    now = datetime.utcnow()
+    return ingest_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_until": {"$lt": now}},
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "started_at": now,
+                "updated_at": now,
+                "lease_until": now + timedelta(seconds=INGEST_JOB_LEASE_SECONDS),
+                "lease_owner": uuid.uuid4().hex,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _held(job):
+    # Matches the job only while this claim still owns it
+    return {"_id": job["_id"], "status": "running", "lease_owner": job["lease_owner"]}
+
+
+def _renew_lease(job, **fields):
+    """Extend the lease of a claimed job; returns False once the claim is lost"""
+    now = datetime.utcnow()
+    result = ingest_jobs.update_one(_held(job), {"$set": {
+        **fields,
+        "updated_at": now,
+        "lease_until": now + timedelta(seconds=INGEST_JOB_LEASE_SECONDS),
+    }})
+    return result.matched_count == 1
+
+
+class _LeaseHeartbeat:
+    """Renews a job's lease while it runs, so long extractions are not claimed twice"""
+
+    def __init__(self, job, interval=INGEST_JOB_LEASE_SECONDS / 3):
+        self.job = job
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ingest-lease", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not _renew_lease(self.job):
+                    self.lost.set()
+                    return
+            except Exception as e:
+                print(f"Không gia hạn được lease của ingestion job {self.job['_id']}: {str(e)}")
+
+    def progress(self, stage, progress):
+        """Record progress, or raise IngestJobCancelled if the job is no longer ours"""
+        if self.lost.is_set() or not _renew_lease(self.job, stage=stage, progress=round(progress, 3)):
+            self.lost.set()
+            raise IngestJobCancelled()
+
+
+def run_ingest_job(job):
+    """Run one claimed job to completion, recording the result on the job and the file record"""
+    job_id = job["_id"]
+    model_name = os.getenv('MODEL_NAME', 'Google AI')
+    api_key = os.getenv('API_KEY')
+    # Jobs queued before sharding was introduced go to the shared shard
+    shard = job.get("shard", SHARED_SHARD)
+    try:
+        with _LeaseHeartbeat(job) as heartbeat:
+            vector_ids = ingest_file(
+                job["file_id"], job["filename"], job["user_id"], model_name, api_key,
+                progress=heartbeat.progress, shard=shard
+            )
+    except IngestJobCancelled:
+        print(f"Dừng index file {job['filename']}: job đã bị hủy hoặc được worker khác nhận")
+        return
+    except Exception as e:
+        print(f"Lỗi khi index file {job['filename']}: {str(e)}")
+        # A PDF without text fails the same way every time
+        retry = not isinstance(e, UnreadablePDFError) and job["attempts"] < INGEST_MAX_ATTEMPTS
+        recorded = ingest_jobs.update_one(
+            _held(job),
+            {"$set": {
+                "status": "queued" if retry else "failed",
+                "error": str(e),
+                "updated_at": datetime.utcnow(),
+            }}
+        )
+        if not retry and recorded.matched_count:
+            db.files.update_many(
+                {"file_id": job["file_id"], **shard_query(shard)},
+                {"$set": {"indexed": False, "index_error": str(e)}}
+            )
+        return
+
+    now = datetime.utcnow()
+    finished = ingest_jobs.update_one(
+        _held(job),
+        {"$set": {
+            "status": "done",
+            "stage": "done",
+            "progress": 1.0,
+            "error": None,
+            "chunk_count": len(vector_ids),
+            "updated_at": now,
+            "finished_at": now,
+        }}
+    )
+    if finished.matched_count == 0:
+        # Cancelled or reclaimed while indexing: the chunks must not stay in the index
+        _discard_chunks(job, vector_ids, model_name, api_key, shard)
+        return
+
+    # The uploaded record and records deduplicated onto this job keep the ids for deletion
+    recorded = db.files.update_many(
+        {"$or": [{"_id": ObjectId(job["file_record_id"])}, {"job_id": str(job_id)}]},
+        {"$set": {"vector_ids": vector_ids}}
+    )
+    if recorded.matched_count == 0:
+        # Every record using this job was deleted while it ran
+        _discard_chunks(job, vector_ids, model_name, api_key, shard)
+        return
+    # Records of the same shard deduplicated onto this blob become searchable at the same time
+    db.files.update_many(
+        {"file_id": job["file_id"], **shard_query(shard)},
+        {"$set": {"indexed": True}, "$unset": {"index_error": ""}}
+    )
+
+
+def _discard_chunks(job, vector_ids, model_name, api_key, shard):
+    print(f"Xóa {len(vector_ids)} chunk của file {job['filename']} đã bị hủy")
+    delete_from_vector_store(vector_ids, model_name, api_key, shard)
+
+
+async def _worker_loop():
+    while True:
+        try:
+            job = await run_db(claim_next_job)
+            if job is None:
+                await asyncio.sleep(INGEST_POLL_INTERVAL)
+                continue
+            await run_in_threadpool(run_ingest_job, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Lỗi trong ingestion worker: {str(e)}")
+            await asyncio.sleep(INGEST_POLL_INTERVAL)
+
+
+def start_ingest_workers():
+    for _ in range(INGEST_CONCURRENCY):
+        _workers.append(asyncio.create_task(_worker_loop()))
+
+
+async def stop_ingest_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,231 @@
+"""
+Per-stage latency histograms and counters, exposed in the Prometheus text format.
+
+Every stage of ingestion and question answering runs inside ``stage(name)``,
+which records its duration in the ``rag_stage_seconds`` histogram and, while
+an HTTP request is being handled, in that request's Server-Timing header.
+Metrics live in the memory of one process; with several workers each one is
+scraped separately.
+
+A sampling profiler can be enabled per request (PROFILING_ENABLED=true and an
+``X-Profile: 1`` header): while the request runs, the stacks of every thread
+executing code of this application are sampled every PROFILE_INTERVAL_MS and
+written in folded format (one ``frame;frame;... count`` line per stack, the
+input of flamegraph.pl and speedscope) to PROFILE_DIR.
+
+This module must stay importable without config.py, like extraction.py.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter as _StackCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_label_text(self.labels, key)} {value}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_label_text(self.labels, key)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def _samples(self, key, state):
+        counts, count, total = state
+        names = self.labels + ("le",)
+        lines = [
+            f"{self.name}_bucket{_label_text(names, key + (bound,))} {bucket_count}"
+            for bound, bucket_count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{_label_text(names, key + ('+Inf',))} {count}")
+        lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duration of each pipeline stage", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds", "Duration of HTTP requests until the response starts", ["method", "route", "status"]
+)
+CHUNKS_EMBEDDED = Counter("rag_chunks_embedded_total", "Chunks embedded for indexing")
+EMBEDDING_CACHE_LOOKUPS = Counter("rag_embedding_cache_lookups_total", "Embedding cache lookups of chunks", ["result"])
+QUERIES_EMBEDDED = Counter("rag_queries_embedded_total", "Questions embedded")
+PAGES_EXTRACTED = Counter("rag_pages_extracted_total", "PDF pages extracted", ["method"])
+PROMPT_TOKENS = Counter("rag_prompt_tokens_total", "Tokens of the prompts sent to the chat model")
+ANSWER_CACHE_LOOKUPS = Counter("rag_answer_cache_lookups_total", "Semantic answer cache lookups", ["result"])
+INDEX_LOADS = Counter("rag_index_loads_total", "Vector index versions loaded from disk")
+CONVERSATION_QUEUE_DEPTH = Gauge("rag_conversation_queue_depth", "Conversations waiting to be written")
+CONVERSATION_FLUSH_SECONDS = Histogram("rag_conversation_flush_seconds", "Duration of conversation insert_many batches")
+CONVERSATIONS_LOGGED = Counter("rag_conversations_logged_total", "Conversations handed to the logger", ["result"])
+
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    """Collect the stages of the current request; returns the list they are appended to"""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def stage_totals(timings=None):
+    """Milliseconds spent per stage by the current request (or in timings)"""
+    totals = {}
+    for name, elapsed in (timings if timings is not None else _request_timings.get() or []):
+        totals[name] = totals.get(name, 0.0) + elapsed * 1000
+    return {name: round(ms, 1) for name, ms in totals.items()}
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def server_timing(timings):
+    """Server-Timing header value; repeated stages are added up"""
+    return ", ".join(f"{name};dur={ms}" for name, ms in stage_totals(timings).items())
+
+
+def profile_path(name, directory=PROFILE_DIR):
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in name.strip("/")) or "root"
+    return os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe}-{os.getpid()}-{time.monotonic_ns() % 10**6}.folded")
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads running code under root until stopped"""
+
+    def __init__(self, root=os.path.dirname(os.path.abspath(__file__)), interval_ms=PROFILE_INTERVAL_MS):
+        self.root = root
+        self.interval = interval_ms / 1000
+        self.stacks = _StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                ours = False
+                while frame is not None:
+                    code = frame.f_code
+                    # Module-level frames (the script that started the server) do not count
+                    ours = ours or (code.co_filename.startswith(self.root) and code.co_name != "<module>")
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                # Idle pool threads and the event loop waiting for I/O are not sampled
+                if ours:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Save the samples in folded format"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
@@ -13,7 +13,8 @@ from .api import (
     ChatResponse,
     ConversationHistory,
     ConversationHistoryResponse,
-    PDFUploadResponse
+    PDFUploadResponse,
+    IngestJobResponse
 )
 
 from .auth import (
@@ -37,6 +38,7 @@ __all__ = [
     'ConversationHistory',
     'ConversationHistoryResponse',
     'PDFUploadResponse',
+    'IngestJobResponse',
     
     # Auth models
     'Token',
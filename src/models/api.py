@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, Union
+from datetime import datetime
 from bson import ObjectId
 import os
 from models.auth import Token, User, UserCreate
@@ -35,6 +36,9 @@ class ChatResponse(BaseModel):
     answer: str
     timestamp: str
     model_name: str = os.getenv('MODEL_NAME', 'Google AI')
+    cached: bool = False
+    # Tokens of the prompt sent to the model (0 for cached answers)
+    prompt_tokens: int = 0
 
 class ConversationHistory(BaseModel):
     user_id: str
@@ -56,9 +60,51 @@ class PDFUploadResponse(BaseModel):
     message: str
     timestamp: str
 
+class IngestJobResponse(BaseModel):
+    id: str
+    file_id: str
+    filename: str
+    user_id: str
+    status: str
+    stage: str
+    progress: float
+    error: Optional[str] = None
+    attempts: int = 0
+    chunk_count: Optional[int] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+FilterValue = Union[str, int, float, bool]
+
+class RetrievalOptions(BaseModel):
+    # Restrict retrieval to these files and/or chunks whose metadata matches every filter,
+    # e.g. {"filename": "report.pdf"}; a list value matches any of its items
+    file_ids: Optional[List[str]] = None
+    filters: Optional[Dict[str, Union[FilterValue, List[FilterValue]]]] = None
+
+class ChatRequest(RetrievalOptions):
+    question: str
+
+class ChatBatchRequest(RetrievalOptions):
+    questions: List[str]
+    # Stream one NDJSON line per question as it is answered instead of a single JSON body
+    stream: bool = False
 
-class ChatRequest(BaseModel):
+class ChatBatchItem(BaseModel):
+    index: int
     question: str
+    answer: Optional[str] = None
+    cached: bool = False
+    prompt_tokens: int = 0
+    sources: List[Dict[str, Any]] = []
+    error: Optional[str] = None
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchItem]
+    timestamp: str
+    model_name: str
 
 class RegisterRequest(BaseModel):
     username: str
@@ -16,6 +16,12 @@ class User(BaseModel):
     disabled: Optional[bool] = False
     is_admin: bool = False
 
+class UserUpdate(BaseModel):
+    email: Optional[str] = None
+    full_name: Optional[str] = None
+    disabled: Optional[bool] = None
+    is_admin: Optional[bool] = None
+
 class UserInDB(User):
     hashed_password: str
 
@@ -0,0 +1,127 @@
+"""
+Persistent cache of OCR output, one entry per PDF page.
+
+Entries are keyed by the SHA-256 of the PDF content, the page number, the DPI
+and the tesseract language packs, and stored as text files under
+OCR_CACHE_DIR. The least recently used entries are evicted once the cache
+grows past OCR_CACHE_MAX_MB, and entries unused for OCR_CACHE_MAX_AGE_DAYS
+are dropped.
+"""
+import hashlib
+import os
+import threading
+import time
+
+OCR_CACHE_DIR = os.getenv('OCR_CACHE_DIR', 'ocr_cache')  # empty disables the cache
+OCR_CACHE_MAX_MB = float(os.getenv('OCR_CACHE_MAX_MB', '512'))
+OCR_CACHE_MAX_AGE_DAYS = float(os.getenv('OCR_CACHE_MAX_AGE_DAYS', '30'))  # 0 keeps entries forever
+
+# After eviction the cache is trimmed to this fraction of the limit
+_EVICT_TARGET = 0.9
+
+
+def content_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+class OCRCache:
+    def __init__(self, directory, max_bytes, max_age_seconds=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def key(file_hash, page_number, dpi, lang):
+        return hashlib.sha256(f"{file_hash}:{page_number}:{dpi}:{lang}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".txt"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.max_age_seconds and time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                self._remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            # mtime doubles as the last-access time for LRU eviction
+            os.utime(path)
+            return text
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, text):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += os.path.getsize(path)
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until under the size limit"""
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * _EVICT_TARGET
+        for path, mtime, size in entries:
+            expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+            if not expired and total <= target:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._size = total
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    """Return the shared OCR cache, or None when OCR_CACHE_DIR is empty"""
+    global _cache
+    if not OCR_CACHE_DIR:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OCRCache(
+                    OCR_CACHE_DIR,
+                    max_bytes=int(OCR_CACHE_MAX_MB * 1024 * 1024),
+                    max_age_seconds=OCR_CACHE_MAX_AGE_DAYS * 86400,
+                )
+    return _cache
@@ -0,0 +1,67 @@
+"""
+Vector index shards.
+
+Every user's uploads are indexed into their own shard under
+``faiss_index/shards/user-<name>/``; the shared shard lives directly in
+``faiss_index/`` (where the single global index used to be) and holds
+documents everyone may read. Each shard is versioned on its own, while all
+shards share one SQLite docstore.
+
+A query searches only the shards its caller may read: anonymous requests the
+shared shard, users their own shard plus the shared one, admins all shards.
+INDEX_SHARDING=none puts every upload into the shared shard.
+"""
+import hashlib
+import os
+import re
+
+from vector_store import INDEX_PATH
+
+INDEX_SHARDING = os.getenv('INDEX_SHARDING', 'user')
+
+SHARED_SHARD = "shared"
+USER_SHARD_PREFIX = "user-"
+SHARDS_DIR = "shards"
+
+_SAFE_NAME = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def user_shard(user_id):
+    """Shard holding a user's uploads"""
+    if INDEX_SHARDING == 'none' or not user_id:
+        return SHARED_SHARD
+    name = user_id if _SAFE_NAME.fullmatch(user_id) else hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:16]
+    return USER_SHARD_PREFIX + name
+
+
+def shard_path(shard, root=INDEX_PATH):
+    if shard == SHARED_SHARD:
+        return root
+    return os.path.join(root, SHARDS_DIR, shard)
+
+
+def list_shards(root=INDEX_PATH):
+    """All shards that exist on disk, shared first"""
+    shards = [SHARED_SHARD]
+    try:
+        names = sorted(os.listdir(os.path.join(root, SHARDS_DIR)))
+    except FileNotFoundError:
+        names = []
+    return shards + [name for name in names if name.startswith(USER_SHARD_PREFIX)]
+
+
+def readable_shards(user=None):
+    """Shards a user (None for anonymous requests) may search"""
+    if user is None:
+        return [SHARED_SHARD]
+    if getattr(user, "is_admin", False):
+        return list_shards()
+    own = user_shard(user.username)
+    return [SHARED_SHARD] if own == SHARED_SHARD else [own, SHARED_SHARD]
+
+
+def shard_query(shard):
+    """MongoDB filter matching file records of a shard; records from before sharding are shared"""
+    if shard == SHARED_SHARD:
+        return {"shard": {"$in": [SHARED_SHARD, None]}}
+    return {"shard": shard}
@@ -0,0 +1,81 @@
+"""
+Content-addressed PDF storage in GridFS.
+
+Uploads are streamed into GridFS chunk by chunk while their SHA-256 is
+computed, so a large PDF is never held in memory as a whole. When a blob with
+the same hash already exists, the partial upload is aborted and the existing
+blob is reused. sha256 is unique in fs.files, so of two concurrent uploads of
+the same content only one can store it; the other reuses that blob.
+"""
+import hashlib
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from gridfs import GridFS
+from gridfs.errors import FileExists
+from pymongo.errors import DuplicateKeyError
+
+from config import db
+from database import run_db
+from metrics import stage
+
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+
+
+async def save_upload(upload, user_id):
+    """Stream an UploadFile into GridFS.
+
+    Returns:
+        (file_id, size, sha256, duplicate) where duplicate is True when the
+        content was already stored and file_id points at the existing blob
+    """
+    fs = GridFS(db)
+    grid_in = await run_db(
+        fs.new_file,
+        filename=upload.filename,
+        content_type=upload.content_type,
+        uploadDate=datetime.utcnow(),
+        user_id=user_id
+    )
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            size += len(chunk)
+            await run_db(grid_in.write, chunk)
+    except Exception:
+        await run_db(grid_in.abort)
+        raise
+
+    digest = sha256.hexdigest()
+    existing = await run_db(db.fs.files.find_one, {"sha256": digest}, {"_id": 1})
+    if existing is not None:
+        # Same content is already stored: drop the chunks written so far
+        await run_db(grid_in.abort)
+        return existing["_id"], size, digest, True
+
+    grid_in.sha256 = digest
+    try:
+        await run_db(grid_in.close)
+    except (DuplicateKeyError, FileExists):
+        # A concurrent upload stored the same content after the check above (GridFS reports
+        # the unique sha256 violation as FileExists)
+        await run_db(grid_in.abort)
+        existing = await run_db(db.fs.files.find_one, {"sha256": digest}, {"_id": 1})
+        return existing["_id"], size, digest, True
+    return grid_in._id, size, digest, False
+
+
+def read_file(file_id):
+    """Read a stored PDF back from GridFS"""
+    with stage("gridfs_read"):
+        return GridFS(db).get(ObjectId(file_id)).read()
+
+
+def delete_file(file_id):
+    GridFS(db).delete(ObjectId(file_id))
@@ -0,0 +1,163 @@
+"""
+Process-wide holder for the FAISS vector store.
+
+The index is loaded from disk once and shared by every request. Each write
+publishes a new immutable version under ``faiss_index/v<N>/`` and then
+atomically repoints ``faiss_index/CURRENT`` at it, so readers in this and
+other worker processes pick the new version up on their next check while
+in-flight queries keep the snapshot they started with.
+
+Writers may run in several worker processes, so every load -> modify ->
+commit cycle holds ``write_lock()``: a thread lock plus an exclusive flock on
+``.write.lock`` in the index folder. Without it two processes could both
+build on version N and one of them would overwrite the other's v(N+1).
+
+Chunk text is not part of a version; it lives in the shared SQLite docstore
+next to the versions (see docstore.py).
+"""
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: writes are then only serialized within one process
+    fcntl = None
+
+from ann_index import write_index_meta
+from docstore import LEGACY_DOCSTORE_FILE
+from metrics import INDEX_LOADS, stage
+
+INDEX_PATH = os.getenv('FAISS_INDEX_PATH', 'faiss_index')
+RELOAD_CHECK_INTERVAL = float(os.getenv('INDEX_RELOAD_CHECK_INTERVAL', '2'))
+KEEP_VERSIONS = int(os.getenv('INDEX_KEEP_VERSIONS', '2'))
+
+CURRENT_FILE = "CURRENT"
+WRITE_LOCK_FILE = ".write.lock"
+
+Snapshot = namedtuple("Snapshot", ["store", "version"])
+
+
+def read_current_version(path=INDEX_PATH):
+    """Return the published index version, 0 for a legacy flat layout, or None if no index exists"""
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        # Index saved before versioning was introduced lives directly in the folder
+        if os.path.exists(os.path.join(path, "index.faiss")):
+            return 0
+        return None
+
+
+def version_dir(version, path=INDEX_PATH):
+    if version == 0:
+        return path
+    return os.path.join(path, f"v{version}")
+
+
+class VectorStoreHolder:
+    def __init__(self, loader, path=INDEX_PATH, check_interval=RELOAD_CHECK_INTERVAL):
+        """
+        Args:
+            loader: callable taking a version directory and returning a vector store;
+                called with writable=True when the caller is going to modify it
+            path: root folder of the versioned index
+            check_interval: minimum seconds between checks of the CURRENT pointer
+        """
+        self.path = path
+        self._loader = loader
+        self._check_interval = check_interval
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def write_lock(self):
+        """Serialize writers of this index across threads and worker processes"""
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, WRITE_LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self):
+        """Return the current Snapshot, reloading if another writer published a newer version"""
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - self._last_check >= self._check_interval:
+            snapshot = self.refresh()
+        if snapshot is None:
+            raise FileNotFoundError(f"No vector index found in {self.path}")
+        return snapshot
+
+    def refresh(self):
+        with self._lock:
+            self._last_check = time.monotonic()
+            version = read_current_version(self.path)
+            snapshot = self._snapshot
+            if version is None:
+                return snapshot
+            if snapshot is None or snapshot.version != version:
+                with stage("index_load"):
+                    store = self._loader(version_dir(version, self.path))
+                INDEX_LOADS.inc()
+                snapshot = Snapshot(store, version)
+                self._snapshot = snapshot
+                print(f"Loaded vector index version {version}")
+            return snapshot
+
+    def current_version(self):
+        return read_current_version(self.path)
+
+    def load_version(self, version):
+        """Load a private copy of a version, e.g. to modify it before committing"""
+        return self._loader(version_dir(version, self.path), writable=True)
+
+    def is_legacy(self, version):
+        """True if the version was saved by LangChain with a pickled docstore"""
+        return os.path.exists(os.path.join(version_dir(version, self.path), LEGACY_DOCSTORE_FILE))
+
+    def commit(self, store, meta=None):
+        """Persist store as a new version and publish it.
+
+        Callers must hold write_lock() from loading the version they modify until
+        the commit returns; the store passed in
+        must not be modified afterwards because readers may already be using it.
+        meta, if given, is written to index_meta.json in the version folder.
+        """
+        version = (read_current_version(self.path) or 0) + 1
+        target = version_dir(version, self.path)
+        store.save_local(target)
+        if meta is not None:
+            write_index_meta(target, meta)
+
+        # Repoint CURRENT atomically so readers never see a half-written version
+        tmp_path = os.path.join(self.path, f".{CURRENT_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(version))
+        os.replace(tmp_path, os.path.join(self.path, CURRENT_FILE))
+
+        with self._lock:
+            self._snapshot = Snapshot(store, version)
+            self._last_check = time.monotonic()
+
+        self._remove_old_versions(version)
+        return version
+
+    def _remove_old_versions(self, current):
+        for name in os.listdir(self.path):
+            if not name.startswith("v") or not name[1:].isdigit():
+                continue
+            if int(name[1:]) <= current - KEEP_VERSIONS:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)